@@ -0,0 +1,143 @@
+import asyncio
+from asyncio import BoundedSemaphore, Queue
+import inspect
+import logging
+import sys
+import traceback
+
+
+class AsyncioTaskPool:
+
+    __slots__ = ('max_thread', 'main_semaphore', 'sub_semaphore', 'exit_for_any_exception',
+                 '_thread_res_queue', 'valid_for_new_thread', 'log_exception', 'thread_list',
+                 'completed_threads', 'killed_threads')
+
+    def __init__(self, **kwargs):
+        assert 'total_thread_number' in kwargs or ('semaphore' in kwargs and 'max_thread' in kwargs)
+        if 'total_thread_number' in kwargs:
+            self.max_thread = kwargs['total_thread_number']
+            self.main_semaphore = BoundedSemaphore(self.max_thread)
+            self.sub_semaphore = BoundedSemaphore(self.max_thread)
+        else:
+            self.max_thread = kwargs['max_thread']
+            self.main_semaphore = kwargs['semaphore']
+            self.sub_semaphore = BoundedSemaphore(self.max_thread)
+        self.exit_for_any_exception = kwargs.get("exit_for_any_exception", False)
+        self._thread_res_queue = Queue()
+        self.valid_for_new_thread = True
+        self.log_exception = kwargs.get('log_exception', True)
+        self.thread_list = []
+        self.completed_threads = set()
+        self.killed_threads = set()
+
+    async def start_thread(self, thread_number, func, args, kwargs):
+        success = True
+        res = None
+        try:
+            res = func(*args, **kwargs)
+            if inspect.isawaitable(res):
+                res = await res
+        except Exception as e:
+            res = e
+            err_msg = traceback.format_exc()
+            if self.log_exception:
+                logging.error(f"Task {thread_number} failed when execute {func.__name__}, error msg: \n{err_msg}")
+            if self.exit_for_any_exception:
+                sys.exit()
+            success = False
+        finally:
+            if thread_number not in self.killed_threads:
+                self.main_semaphore.release()
+                self.sub_semaphore.release()
+                self.completed_threads.add(thread_number)
+                self._thread_res_queue.put_nowait((thread_number, success, res))
+
+    async def apply_async(self, func, args=None, kwargs=None):
+        assert self.valid_for_new_thread
+        await self.main_semaphore.acquire()
+        await self.sub_semaphore.acquire()
+        if args is None:
+            args = tuple()
+        if kwargs is None:
+            kwargs = dict()
+        task = asyncio.ensure_future(self.start_thread(len(self.thread_list), func, args, kwargs))
+        self.thread_list.append(task)
+        return task
+
+    def new_shared_pool(self, exit_for_any_exception=False, max_thread=0):
+        return AsyncioTaskPool(semaphore=self.main_semaphore, exit_for_any_exception=exit_for_any_exception,
+                               max_thread=max_thread if max_thread > 0 else self.max_thread)
+
+    async def get_results_order_by_index(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
+        self.valid_for_new_thread = False
+        threads_result = [''] * len(self.thread_list) if with_status else [('', '')] * len(self.thread_list)
+        for _ in range(len(self.thread_list) - len(self.killed_threads)):
+            thread_number, success, res = await self._thread_res_queue.get()
+            if success or not raise_exception:
+                threads_result[thread_number] = (success, res) if with_status else res
+            else:
+                if stop_all_for_exception:
+                    logging.info('stop all')
+                    self.stop_all()
+                self.refresh()
+                raise res
+        self.refresh()
+        return threads_result
+
+    async def get_results_order_by_time(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
+        self.valid_for_new_thread = False
+        total = len(self.thread_list) - len(self.killed_threads)
+        for index in range(total):
+            thread_number, success, res = await self._thread_res_queue.get()
+            if success or not raise_exception:
+                if index == total - 1:
+                    self.refresh()
+                yield (success, res) if with_status else res
+            else:
+                if stop_all_for_exception:
+                    self.stop_all()
+                self.refresh()
+                raise res
+
+    async def get_one_result(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
+        thread_number, success, res = await self._thread_res_queue.get()
+        self.killed_threads.add(thread_number)
+        if not success and raise_exception:
+            if stop_all_for_exception:
+                self.stop_all()
+            raise res
+        return (success, res) if with_status else res
+
+    async def wait_all_threads(self, raise_exception=False):
+        await asyncio.gather(*self.thread_list, return_exceptions=True)
+        for _ in range(len(self.thread_list) - len(self.killed_threads)):
+            thread_number, success, res = await self._thread_res_queue.get()
+            if not success and not raise_exception:
+                self.refresh()
+                raise res
+        self.refresh()
+
+    def stop_all(self):
+        for index in range(len(self.thread_list)):
+            self.stop_nth_thread(index)
+
+    def stop_nth_thread(self, n):
+        if n not in self.completed_threads:
+            self.completed_threads.add(n)
+            self.killed_threads.add(n)
+            self.main_semaphore.release()
+            self.sub_semaphore.release()
+            self.thread_list[n].cancel()
+
+    def refresh(self):
+        self.thread_list = []
+        self.valid_for_new_thread = True
+        self.completed_threads = set()
+        self.killed_threads = set()
+        self._thread_res_queue = Queue()
+
+    @classmethod
+    def new_thread(cls, target, args=None, kwargs=None):
+        args = args if args is not None else tuple()
+        kwargs = kwargs if kwargs is not None else dict()
+        return asyncio.ensure_future(target(*args, **kwargs))
@@ -1,76 +1,474 @@
+import functools
+import itertools
 import logging
 import sys
+import time
 import traceback
+import weakref
 
 import gevent
 from gevent._semaphore import BoundedSemaphore
-from gevent.queue import Queue
+from gevent.event import Event
+from gevent.queue import Empty, Full, PriorityQueue, Queue
+from gevent.threadpool import ThreadPool
+
+from pool_adaptive import AimdController
+from pool_deadlines import DeadlineTimer, TaskLease
+from pool_dedup import CallCoalescer
+from pool_exceptions import PoolFullError, TaskDroppedError, TaskTimeoutError
+from pool_hub_monitor import hub_blocking_detector
+from pool_metrics import PoolMetrics
+from pool_rate_limit import TokenBucket
+from pool_scheduling import FairScheduler, FairShare, priority_key
+
+
+def apply_call(func, args, kwargs):
+    try:
+        return True, func(*args, **kwargs)
+    except Exception as e:
+        return False, e
+
+
+def apply_chunk(func, chunk):
+    results = []
+    for item in chunk:
+        try:
+            results.append((True, func(item)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class PriorityBacklog(PriorityQueue):
+
+    def _get(self):
+        return PriorityQueue._get(self)[1]
 
 
 class GeventThreadPool:
 
     __slots__ = ('max_thread', 'main_semaphore', 'sub_semaphore', 'exit_for_any_exception',
                  '_thread_res_queue', 'valid_for_new_thread', 'log_exception', 'thread_list',
-                 'completed_threads', 'killed_threads')
+                 'completed_threads', 'killed_threads', 'backlog', 'overflow_policy', 'dispatcher',
+                 'long_running', 'task_counter', 'metrics', 'fair_share', 'prioritized', 'aging_seconds',
+                 'deadline', 'deadline_timer', 'rate_limiter', 'blocking_tier', 'blocking_threshold',
+                 'concurrency_controller', 'coalescer', '__weakref__')
 
     def __init__(self, **kwargs):
         assert 'total_thread_number' in kwargs or ('semaphore' in kwargs and 'max_thread' in kwargs)
+        self.fair_share = kwargs.get('fair_share', False)
+        self.prioritized = kwargs.get('prioritized', False)
+        self.aging_seconds = kwargs.get('aging_seconds', 10.0)
+        self.rate_limiter = kwargs.get('rate_limiter')
+        if self.rate_limiter is None and kwargs.get('rate_limit', 0) > 0:
+            self.rate_limiter = TokenBucket(kwargs['rate_limit'], kwargs.get('burst', 0), gevent.sleep)
         if 'total_thread_number' in kwargs:
             self.max_thread = kwargs['total_thread_number']
-            self.main_semaphore = BoundedSemaphore(self.max_thread)
-            self.sub_semaphore = BoundedSemaphore(self.max_thread)
+            if self.fair_share or self.prioritized or kwargs.get('adaptive', False):
+                self.main_semaphore = FairScheduler(self.max_thread, Event, self.aging_seconds).tenant(kwargs.get('weight', 1), kwargs.get('min_threads', 0), kwargs.get('name', 'root'))
+            else:
+                self.main_semaphore = BoundedSemaphore(self.max_thread)
         else:
             self.max_thread = kwargs['max_thread']
             self.main_semaphore = kwargs['semaphore']
+        if self.prioritized:
+            self.sub_semaphore = FairScheduler(self.max_thread, Event, self.aging_seconds).tenant(name='sub')
+        else:
             self.sub_semaphore = BoundedSemaphore(self.max_thread)
+        self.concurrency_controller = kwargs.get('concurrency_controller')
+        if self.concurrency_controller is None and kwargs.get('adaptive', False):
+            assert isinstance(self.main_semaphore, FairShare)
+            self.concurrency_controller = AimdController(self.main_semaphore.scheduler, kwargs.get('min_concurrency', 1), self.max_thread,
+                                                         kwargs.get('initial_concurrency', 0), kwargs.get('adaptive_window', 0))
         self.exit_for_any_exception = kwargs.get("exit_for_any_exception", False)
         self._thread_res_queue = Queue()
         self.valid_for_new_thread = True
         self.log_exception = kwargs.get('log_exception', True)
-        self.thread_list = []
+        self.long_running = kwargs.get('long_running', False)
+        self.thread_list = {} if self.long_running else []
+        self.task_counter = 0
+        self.metrics = PoolMetrics(self.max_thread) if kwargs.get('metrics', False) else None
         self.completed_threads = set()
         self.killed_threads = set()
+        backlog_capacity = kwargs.get('backlog_capacity', 0)
+        if backlog_capacity > 0:
+            self.backlog = PriorityBacklog(backlog_capacity) if self.prioritized else Queue(backlog_capacity)
+        else:
+            self.backlog = None
+        self.overflow_policy = kwargs.get('overflow_policy', 'block')
+        assert self.overflow_policy in ('block', 'raise', 'drop_oldest', 'caller_runs')
+        assert not (self.prioritized and self.backlog is not None and self.overflow_policy == 'drop_oldest')
+        self.dispatcher = None
+        self.deadline = None
+        self.deadline_timer = DeadlineTimer(self._expire, gevent.spawn, Event)
+        self.blocking_tier = kwargs.get('blocking_tier')
+        if self.blocking_tier is None and kwargs.get('blocking_threads', 0) > 0:
+            self.blocking_tier = ThreadPool(kwargs['blocking_threads'])
+        self.blocking_threshold = kwargs.get('blocking_threshold', 0)
+        if self.blocking_threshold > 0:
+            hub_blocking_detector.register(self.blocking_threshold)
+            weakref.finalize(self, hub_blocking_detector.unregister, self.blocking_threshold)
+        self.coalescer = kwargs.get('coalescer')
+        if self.coalescer is None and kwargs.get('dedup_key') is not None:
+            self.coalescer = CallCoalescer(kwargs['dedup_key'], Event)
+        assert self.coalescer is None or self.backlog is None
 
-    def start_thread(self, thread_number, func, args, kwargs):
+    def start_thread(self, thread_number, func, args, kwargs, holds_slot=True, lease=None, call=None):
         success = True
+        finished = False
         res = None
+        follows = call is not None and not holds_slot
+        metrics = self.metrics if not follows else None
+        started_at = metrics.task_started(thread_number) if metrics is not None else time.perf_counter()
         try:
             res = func(*args, **kwargs)
+            finished = True
         except Exception as e:
             res = e
             err_msg = traceback.format_exc()
-            if self.log_exception:
+            if self.log_exception and not follows:
                 logging.error(f"Thread {thread_number} failed when execute {func.__name__}, error msg: \n{err_msg}")
-            if self.exit_for_any_exception:
+            if self.exit_for_any_exception and not follows:
                 sys.exit()
             success = False
+            finished = True
         finally:
-            self.main_semaphore.release()
-            self.sub_semaphore.release()
-            self.completed_threads.add(thread_number)
-            self._thread_res_queue.put((thread_number, success, res))
+            if metrics is not None:
+                metrics.task_finished(started_at, success, not finished)
+            settled = lease is None or lease.settle()
+            if call is not None and not follows:
+                if finished:
+                    self.coalescer.finish(call, success, res)
+                elif not settled:
+                    self.coalescer.finish(call, False, TaskTimeoutError(f'Thread {thread_number} timed out'))
+                else:
+                    self.coalescer.drop(call)
+            if settled:
+                if lease is not None:
+                    self.deadline_timer.discard()
+                if finished and not follows and self.concurrency_controller is not None:
+                    self.concurrency_controller.observe(time.perf_counter() - started_at, success)
+                if holds_slot:
+                    self.main_semaphore.release()
+                    self.sub_semaphore.release()
+                self.completed_threads.add(thread_number)
+                if self.long_running and thread_number in self.killed_threads:
+                    self._release_record(thread_number)
+                else:
+                    self._thread_res_queue.put((thread_number, success, res))
+
+    def apply_async(self, func, args=None, kwargs=None, priority=0, timeout=None, blocking=False):
+        assert self.valid_for_new_thread
+        if args is None:
+            args = tuple()
+        if kwargs is None:
+            kwargs = dict()
+        call = None
+        if self.coalescer is not None:
+            call, leads = self.coalescer.join(func, args, kwargs)
+            if not leads:
+                return self._follow(call, func, args, kwargs, timeout)
+        if blocking:
+            func = self._offload(func)
+        if self.backlog is not None:
+            return self._enqueue(func, args, kwargs, self.overflow_policy, priority, timeout)
+        submitted_at = time.perf_counter() if self.metrics is not None else None
+        self._acquire_slot(priority)
+        thread_number = self._new_thread_number()
+        if self.metrics is not None:
+            self.metrics.task_submitted(thread_number, submitted_at)
+        lease = self._new_lease(thread_number, timeout)
+        thread = self._lead(call, thread_number, func, args, kwargs, lease)
+        self._track(thread_number, thread)
+        self._start_lease(lease, thread)
+        return thread
 
-    def apply_async(self, func, args=None, kwargs=None):
+    def try_apply_async(self, func, args=None, kwargs=None, priority=0, timeout=None, blocking=False):
         assert self.valid_for_new_thread
-        self.main_semaphore.acquire()
-        self.sub_semaphore.acquire()
         if args is None:
             args = tuple()
         if kwargs is None:
             kwargs = dict()
-        thread = gevent.spawn(self.start_thread, len(self.thread_list), func, args, kwargs)
-        self.thread_list.append(thread)
+        call = None
+        if self.coalescer is not None:
+            call, leads = self.coalescer.join(func, args, kwargs)
+            if not leads:
+                return self._follow(call, func, args, kwargs, timeout)
+        if blocking:
+            func = self._offload(func)
+        if self.backlog is not None:
+            try:
+                return self._enqueue(func, args, kwargs, 'raise', priority, timeout)
+            except PoolFullError:
+                return None
+        if not self._acquire_slot(priority, blocking=False):
+            if call is not None:
+                self.coalescer.withdraw(call)
+            return None
+        thread_number = self._new_thread_number()
+        if self.metrics is not None:
+            self.metrics.task_submitted(thread_number)
+        lease = self._new_lease(thread_number, timeout)
+        thread = self._lead(call, thread_number, func, args, kwargs, lease)
+        self._track(thread_number, thread)
+        self._start_lease(lease, thread)
+        return thread
+
+    def _lead(self, call, thread_number, func, args, kwargs, lease):
+        thread = gevent.spawn(self.start_thread, thread_number, func, args, kwargs, True, lease, call)
+        if call is not None:
+            thread.rawlink(lambda _: self.coalescer.drop(call))
+        return thread
+
+    def _follow(self, call, func, args, kwargs, timeout):
+        thread_number = self._new_thread_number()
+        thread = gevent.spawn(self.start_thread, thread_number, call.follower(func, timeout), args, kwargs, False, None, call)
+        self._track(thread_number, thread)
+        return thread
+
+    def _acquire_slot(self, priority=0, blocking=True):
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(blocking):
+            return False
+        if isinstance(self.main_semaphore, FairShare):
+            acquired = self.main_semaphore.acquire(blocking, priority=priority)
+        else:
+            acquired = self.main_semaphore.acquire(blocking=blocking)
+        if acquired:
+            if self.prioritized:
+                acquired = self.sub_semaphore.acquire(blocking, priority=priority)
+            else:
+                acquired = self.sub_semaphore.acquire(blocking=blocking)
+            if not acquired:
+                self.main_semaphore.release()
+        if not acquired and self.rate_limiter is not None:
+            self.rate_limiter.release()
+        return acquired
+
+    def set_deadline(self, seconds):
+        self.deadline = time.perf_counter() + seconds if seconds is not None else None
+
+    def _new_lease(self, thread_number, timeout):
+        if timeout is None and self.deadline is None:
+            return None
+        return TaskLease(thread_number, timeout, self._thread_res_queue)
+
+    def _start_lease(self, lease, handle):
+        if lease is not None:
+            lease.handle = handle
+            self.deadline_timer.schedule(lease, self.deadline)
+
+    def _expire(self, lease):
+        if not lease.settle():
+            return
+        thread_number = lease.thread_number
+        if self.concurrency_controller is not None:
+            self.concurrency_controller.observe(time.perf_counter() - lease.started_at, False)
+        lease.handle.kill(block=False)
+        self.main_semaphore.release()
+        self.sub_semaphore.release()
+        if lease.result_queue is self._thread_res_queue:
+            self.completed_threads.add(thread_number)
+            if not (self.long_running and thread_number in self.killed_threads):
+                lease.result_queue.put((thread_number, False, TaskTimeoutError(f'Thread {thread_number} timed out')))
+            else:
+                self._release_record(thread_number)
+
+    def _new_thread_number(self):
+        thread_number = self.task_counter
+        self.task_counter += 1
+        return thread_number
+
+    def _native_tier(self):
+        if self.blocking_tier is None:
+            self.blocking_tier = ThreadPool(self.max_thread)
+        return self.blocking_tier
+
+    def _offload(self, func):
+        tier = self._native_tier()
+
+        @functools.wraps(func)
+        def run_in_native_thread(*args, **kwargs):
+            success, res = tier.apply(apply_call, (func, args, kwargs))
+            if not success:
+                raise res
+            return res
+
+        return run_in_native_thread
+
+    def _track(self, thread_number, thread):
+        if self.blocking_threshold > 0:
+            hub_blocking_detector.label(thread, thread.args[1], self.blocking_threshold)
+        if self.long_running:
+            self.thread_list[thread_number] = thread
+        else:
+            self.thread_list.append(thread)
+
+    def _release_record(self, thread_number):
+        self.thread_list.pop(thread_number, None)
+        self.completed_threads.discard(thread_number)
+        self.killed_threads.discard(thread_number)
+
+    def _pending_result_count(self):
+        if self.long_running:
+            return len(self.thread_list)
+        return len(self.thread_list) - len(self.killed_threads)
+
+    def _enqueue(self, func, args, kwargs, overflow_policy, priority=0, timeout=None):
+        thread_number = self._new_thread_number()
+        thread = gevent.Greenlet(self.start_thread, thread_number, func, args, kwargs, True, self._new_lease(thread_number, timeout))
+        self._track(thread_number, thread)
+        if self.metrics is not None:
+            self.metrics.task_submitted(thread_number)
+        while True:
+            try:
+                item = (priority_key(priority, self.aging_seconds), thread) if self.prioritized else thread
+                self.backlog.put(item, block=overflow_policy == 'block')
+                break
+            except Full:
+                if overflow_policy == 'raise':
+                    if self.metrics is not None:
+                        self.metrics.task_discarded(thread_number, killed=False)
+                    if self.long_running:
+                        self.thread_list.pop(thread_number)
+                    else:
+                        self.thread_list.pop()
+                        self.task_counter -= 1
+                    raise PoolFullError(f'Backlog is full with {self.backlog.maxsize} pending tasks')
+                if overflow_policy == 'caller_runs':
+                    thread = gevent.spawn(self.start_thread, thread_number, func, args, kwargs, False)
+                    self.thread_list[thread_number] = thread
+                    thread.join()
+                    return thread
+            try:
+                self._drop(self.backlog.get_nowait())
+            except Empty:
+                pass
+        if self.dispatcher is None:
+            self.dispatcher = gevent.spawn(self._dispatch)
         return thread
 
-    def new_shared_pool(self, exit_for_any_exception=False, max_thread=0):
-        return GeventThreadPool(semaphore=self.main_semaphore, exit_for_any_exception=exit_for_any_exception,
-                          max_thread=max_thread if max_thread > 0 else self.max_thread)
+    def _drop(self, thread):
+        thread_number = thread.args[0]
+        thread.kill()
+        if self.metrics is not None:
+            self.metrics.task_discarded(thread_number, killed=thread_number in self.killed_threads)
+        if thread_number not in self.killed_threads:
+            self.completed_threads.add(thread_number)
+            self._thread_res_queue.put((thread_number, False, TaskDroppedError(f'Thread {thread_number} dropped from backlog')))
+        elif self.long_running:
+            self._release_record(thread_number)
+
+    def _dispatch(self):
+        while True:
+            thread = self.backlog.get()
+            if thread.dead:
+                continue
+            self._acquire_slot()
+            if thread.dead:
+                self.main_semaphore.release()
+                self.sub_semaphore.release()
+                continue
+            self._start_lease(thread.args[5], thread)
+            thread.start()
+
+    def map(self, func, iterable, chunksize=1, ordered=True, window=0, raise_exception=False, with_status=False, blocking=False):
+        window = window if window > 0 else 2 * self.max_thread
+        tier = self._native_tier() if blocking else None
+        chunk_res_queue = Queue()
+        iterator = iter(iterable)
+        buffered_chunks = {}
+        submitted_chunks = 0
+        yielded_chunks = 0
+        exhausted = False
+        while True:
+            while not exhausted and submitted_chunks - yielded_chunks < window:
+                chunk = list(itertools.islice(iterator, chunksize))
+                if not chunk:
+                    exhausted = True
+                    break
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(count=len(chunk))
+                self.main_semaphore.acquire()
+                self.sub_semaphore.acquire()
+                gevent.spawn(self._run_chunk, submitted_chunks, func, chunk, chunk_res_queue, tier)
+                submitted_chunks += 1
+            if submitted_chunks == yielded_chunks:
+                return
+            chunk_number, results = chunk_res_queue.get()
+            if ordered:
+                buffered_chunks[chunk_number] = results
+                ready_chunks = []
+                while yielded_chunks + len(ready_chunks) in buffered_chunks:
+                    ready_chunks.append(buffered_chunks.pop(yielded_chunks + len(ready_chunks)))
+            else:
+                ready_chunks = [results]
+            for results in ready_chunks:
+                yielded_chunks += 1
+                for success, res in results:
+                    if not success and raise_exception:
+                        raise res
+                    yield (success, res) if with_status else res
+
+    def _run_chunk(self, chunk_number, func, chunk, chunk_res_queue, tier=None):
+        results = []
+        try:
+            results = tier.apply(apply_chunk, (func, chunk)) if tier is not None else apply_chunk(func, chunk)
+        finally:
+            self.main_semaphore.release()
+            self.sub_semaphore.release()
+            for success, res in results:
+                if success:
+                    continue
+                if self.log_exception:
+                    err_msg = ''.join(traceback.format_exception(type(res), res, res.__traceback__))
+                    logging.error(f"Chunk {chunk_number} failed when execute {func.__name__}, error msg: \n{err_msg}")
+                if self.exit_for_any_exception:
+                    sys.exit()
+            chunk_res_queue.put((chunk_number, results))
+
+    def _shared_semaphore(self, weight, min_threads, name):
+        if self.fair_share:
+            return self.main_semaphore.scheduler.tenant(weight, min_threads, name)
+        return self.main_semaphore
+
+    def new_shared_pool(self, exit_for_any_exception=False, max_thread=0, weight=1, min_threads=0, name=None):
+        return GeventThreadPool(semaphore=self._shared_semaphore(weight, min_threads, name), exit_for_any_exception=exit_for_any_exception,
+                          max_thread=max_thread if max_thread > 0 else self.max_thread,
+                          backlog_capacity=self.backlog.maxsize if self.backlog is not None else 0,
+                          overflow_policy=self.overflow_policy, long_running=self.long_running,
+                          metrics=self.metrics is not None, fair_share=self.fair_share,
+                          prioritized=self.prioritized, aging_seconds=self.aging_seconds,
+                          rate_limiter=self.rate_limiter,
+                          concurrency_controller=self.concurrency_controller, blocking_tier=self._native_tier(),
+                          blocking_threshold=self.blocking_threshold, coalescer=self.coalescer)
+
+    def stats(self):
+        return self.metrics.snapshot() if self.metrics is not None else None
+
+    def blocking_stats(self):
+        return hub_blocking_detector.report() if self.blocking_threshold > 0 else None
+
+    def concurrency_stats(self):
+        return self.concurrency_controller.stats() if self.concurrency_controller is not None else None
+
+    def dedup_stats(self):
+        return self.coalescer.stats() if self.coalescer is not None else None
+
+    def rate_limit_stats(self):
+        return self.rate_limiter.stats() if self.rate_limiter is not None else None
+
+    def share_stats(self):
+        return self.main_semaphore.scheduler.stats() if self.fair_share else None
 
     def get_results_order_by_index(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
         self.valid_for_new_thread = False
         threads_result = [''] * len(self.thread_list) if with_status else [('', '')] * len(self.thread_list)
-        for _ in range(len(self.thread_list) - len(self.killed_threads)):
+        positions = {n: index for index, n in enumerate(sorted(self.thread_list))} if self.long_running else None
+        for _ in range(self._pending_result_count()):
             thread_number, success, res = self._thread_res_queue.get()
+            if self.long_running:
+                self._release_record(thread_number)
+                thread_number = positions[thread_number]
             if success or not raise_exception:
                 threads_result[thread_number] = (success, res) if with_status else res
             else:
@@ -83,22 +481,30 @@ class GeventThreadPool:
         return threads_result
 
     def get_results_order_by_time(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
-        self.valid_for_new_thread = False
-        for index in range(len(self.thread_list) - len(self.killed_threads)):
+        if not self.long_running:
+            self.valid_for_new_thread = False
+        total = self._pending_result_count()
+        for index in range(total):
             thread_number, success, res = self._thread_res_queue.get()
+            if self.long_running:
+                self._release_record(thread_number)
             if success or not raise_exception:
-                if index == len(self.thread_list) - 1:
+                if index == total - 1 and not self.long_running:
                     self.refresh()
                 yield (success, res) if with_status else res
             else:
                 if stop_all_for_exception:
                     self.stop_all()
-                self.refresh()
+                if not self.long_running:
+                    self.refresh()
                 raise res
 
     def get_one_result(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
         thread_number, success, res = self._thread_res_queue.get()
-        self.killed_threads.add(thread_number)
+        if self.long_running:
+            self._release_record(thread_number)
+        else:
+            self.killed_threads.add(thread_number)
         if not success and raise_exception:
             if stop_all_for_exception:
                 self.stop_all()
@@ -106,30 +512,57 @@ class GeventThreadPool:
         return (success, res) if with_status else res
 
     def wait_all_threads(self, raise_exception=False):
-        gevent.joinall(self.thread_list)
-        for _ in range(len(self.thread_list) - len(self.killed_threads)):
+        gevent.joinall(list(self.thread_list.values()) if self.long_running else self.thread_list)
+        for _ in range(self._pending_result_count()):
             thread_number, success, res = self._thread_res_queue.get()
+            if self.long_running:
+                self._release_record(thread_number)
             if not success and not raise_exception:
                 self.refresh()
                 raise res
         self.refresh()
 
     def stop_all(self):
-        for index in range(len(self.thread_list)):
+        for index in list(self.thread_list) if self.long_running else range(len(self.thread_list)):
             self.stop_nth_thread(index)
 
     def stop_nth_thread(self, n):
+        if n in self.completed_threads or (self.long_running and n not in self.thread_list):
+            return
+        started = self.thread_list[n].started and self.thread_list[n].args[4]
+        self.thread_list[n].kill()
         if n not in self.completed_threads:
-            self.thread_list[n].kill()
-            if n not in self.completed_threads:
-                self.completed_threads.add(n)
-                self.killed_threads.add(n)
+            self.completed_threads.add(n)
+            self.killed_threads.add(n)
+            if started:
                 self.main_semaphore.release()
                 self.sub_semaphore.release()
+            if self.metrics is not None:
+                self.metrics.task_discarded(n, killed=True)
+            if self.long_running:
+                self._release_record(n)
 
     def refresh(self):
-        self.thread_list = []
         self.valid_for_new_thread = True
+        self.deadline = None
+        while self.backlog is not None and not self.backlog.empty():
+            thread = self.backlog.get_nowait()
+            thread.kill()
+            if self.metrics is not None:
+                self.metrics.task_discarded(thread.args[0], killed=True)
+            if self.long_running:
+                self._release_record(thread.args[0])
+        if self.long_running:
+            for thread_number in list(self.thread_list):
+                if thread_number in self.completed_threads:
+                    self._release_record(thread_number)
+                else:
+                    self.killed_threads.add(thread_number)
+                    self.thread_list.pop(thread_number)
+            self._thread_res_queue = Queue()
+            return
+        self.thread_list = []
+        self.task_counter = 0
         self.completed_threads.clear()
         self.killed_threads.clear()
         self._thread_res_queue = Queue()
@@ -1,8 +1,350 @@
+from collections import deque
+from datetime import datetime, timedelta
+import glob
+import gzip
+from itertools import chain, islice
 import logging
 from logging.handlers import TimedRotatingFileHandler
+import os
+from queue import Queue
+import shutil
 import sys
+import threading
+import time
+import unicodedata
 
-from prettytable import PrettyTable, ALL
+try:
+    from wcwidth import width as _wcwidth
+except ImportError:
+    _wcwidth = None
+
+
+class AsyncLogHandler(logging.Handler):
+
+    def __init__(self, handlers, capacity=10000, overflow='block', batch_size=256):
+        logging.Handler.__init__(self)
+        assert overflow in ('block', 'drop_new', 'drop_oldest')
+        self.handlers = handlers
+        self.capacity = capacity
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.records = deque()
+        self.wakeup = threading.Event()
+        self.drained = threading.Event()
+        self.writer = threading.Thread(target=self._write_forever, name='AsyncLogHandler', daemon=True)
+        self.writer.start()
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def handle(self, record):
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        try:
+            records = self.records
+            if len(records) >= self.capacity:
+                if self.overflow == 'drop_new':
+                    self.dropped += 1
+                    return
+                if self.overflow == 'drop_oldest':
+                    try:
+                        records.popleft()
+                        self.dropped += 1
+                    except IndexError:
+                        pass
+                else:
+                    while len(records) >= self.capacity and self.writer.is_alive():
+                        self.drained.clear()
+                        self.wakeup.set()
+                        self.drained.wait(0.1)
+            records.append(self.prepare(record))
+            if not self.wakeup.is_set():
+                self.wakeup.set()
+        except Exception:
+            self.handleError(record)
+
+    def _write_forever(self):
+        records = self.records
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while records:
+                batch = []
+                while records and len(batch) < self.batch_size:
+                    batch.append(records.popleft())
+                self._write_batch([record for record in batch if isinstance(record, logging.LogRecord)])
+                self.drained.set()
+                for item in batch:
+                    if item is None:
+                        return
+                    if isinstance(item, threading.Event):
+                        item.set()
+
+    def _write_batch(self, records):
+        for handler in self.handlers:
+            accepted = [record for record in records if record.levelno >= handler.level and handler.filter(record)]
+            if not accepted:
+                continue
+            if type(handler) in (logging.StreamHandler, logging.FileHandler):
+                try:
+                    text = ''.join(handler.format(record) + handler.terminator for record in accepted)
+                except Exception:
+                    for record in accepted:
+                        handler.handle(record)
+                    continue
+                with handler.lock:
+                    if handler.stream is None:
+                        handler.stream = handler._open()
+                    handler.stream.write(text)
+                    handler.flush()
+            else:
+                for record in accepted:
+                    handler.handle(record)
+
+    def flush(self):
+        if self.writer.is_alive():
+            flushed = threading.Event()
+            self.records.append(flushed)
+            self.wakeup.set()
+            while not flushed.wait(0.1) and self.writer.is_alive():
+                pass
+
+    def close(self):
+        if self.writer.is_alive():
+            self.records.append(None)
+            self.wakeup.set()
+            self.writer.join()
+        logging.Handler.close(self)
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+
+    rotating_seconds = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400, 'MIDNIGHT': 86400}
+
+    def __init__(self, filename, buffer_size=256 * 1024, max_bytes=0, when=None, interval=1, backup_count=0, compress=True, flush_interval=1.0):
+        logging.Handler.__init__(self)
+        assert when is None or when.upper() in self.rotating_seconds
+        self.filename = os.path.abspath(filename)
+        self.buffer_size = buffer_size
+        self.max_bytes = max_bytes
+        self.when = when.upper() if when else None
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.last_flush = time.monotonic()
+        self.stream = open(self.filename, 'ab')
+        self.file_size = self.stream.tell()
+        self.rollover_at = self._compute_rollover(datetime.now()) if self.when else None
+        self.compress_queue = Queue()
+        self.compressor = None
+        self.stopped = threading.Event()
+        self.flusher = None
+
+    def _compute_rollover(self, now):
+        if self.when == 'MIDNIGHT':
+            return datetime.combine(now.date(), datetime.min.time()) + timedelta(days=self.interval)
+        return now + timedelta(seconds=self.rotating_seconds[self.when] * self.interval)
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + '\n').encode('utf-8')
+        except Exception:
+            self.handleError(record)
+            return
+        self.buffer.append(data)
+        self.buffered_bytes += len(data)
+        if self.buffered_bytes >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush_buffer()
+        elif self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_forever, name='BufferedRotatingFileHandler', daemon=True)
+            self.flusher.start()
+
+    def _flush_forever(self):
+        while not self.stopped.wait(max(self.last_flush + self.flush_interval - time.monotonic(), 0.01)):
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def _flush_buffer(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        if self.rollover_at is not None and datetime.now() >= self.rollover_at:
+            self._rotate()
+        elif self.max_bytes and self.file_size and self.file_size + self.buffered_bytes > self.max_bytes:
+            self._rotate()
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.stream.write(data)
+        self.stream.flush()
+        self.file_size = self.stream.tell()
+
+    def _rotate(self):
+        self.stream.close()
+        base_name = f'{self.filename}.{datetime.now().strftime("%Y%m%d-%H%M%S")}'
+        rotated_name = base_name
+        suffix = 0
+        while os.path.exists(rotated_name) or os.path.exists(f'{rotated_name}.gz'):
+            suffix += 1
+            rotated_name = f'{base_name}.{suffix}'
+        os.rename(self.filename, rotated_name)
+        self.stream = open(self.filename, 'ab')
+        self.file_size = 0
+        if self.rollover_at is not None:
+            self.rollover_at = self._compute_rollover(datetime.now())
+        if self.compress:
+            if self.compressor is None:
+                self.compressor = threading.Thread(target=self._compress_forever, name='BufferedRotatingFileHandler', daemon=True)
+                self.compressor.start()
+            self.compress_queue.put(rotated_name)
+        else:
+            self._remove_old_backups()
+
+    def _compress_forever(self):
+        while True:
+            rotated_name = self.compress_queue.get()
+            try:
+                if rotated_name is None:
+                    return
+                with open(rotated_name, 'rb') as source, gzip.open(f'{rotated_name}.gz', 'wb', compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                os.remove(rotated_name)
+                self._remove_old_backups()
+            except Exception as e:
+                sys.stderr.write(f'Failed to compress {rotated_name}: {e}\n')
+            finally:
+                self.compress_queue.task_done()
+
+    def _remove_old_backups(self):
+        if self.backup_count <= 0:
+            return
+        backups = sorted(glob.glob(f'{glob.escape(self.filename)}.*'), key=os.path.getmtime)
+        for backup in backups[:-self.backup_count]:
+            try:
+                os.remove(backup)
+            except OSError:
+                pass
+
+    def flush(self):
+        with self.lock:
+            if self.stream is not None and not self.stream.closed:
+                self._flush_buffer()
+
+    def close(self):
+        self.stopped.set()
+        if self.flusher is not None and self.flusher is not threading.current_thread():
+            self.flusher.join()
+        with self.lock:
+            if self.stream is not None and not self.stream.closed:
+                self._flush_buffer()
+                self.stream.close()
+        if self.compressor is not None and self.compressor.is_alive():
+            self.compress_queue.put(None)
+            self.compressor.join()
+        logging.Handler.close(self)
+
+
+def _text_width(text):
+    if text.isascii() and text.isprintable():
+        return len(text)
+    if _wcwidth is not None:
+        return _wcwidth(text)
+    return sum(0 if unicodedata.combining(c) else 2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+
+
+def _center(text, width):
+    margin = width - _text_width(text)
+    left = margin // 2 + (margin & width & 1)
+    return ' ' * left + text + ' ' * (margin - left)
+
+
+def _fit(text, width):
+    if _text_width(text) <= width:
+        return text
+    ellipsis = '...' if width > 3 else ''
+    limit = width - len(ellipsis)
+    if text.isascii():
+        return text[:limit] + ellipsis
+    used = 0
+    for index, c in enumerate(text):
+        used += _text_width(c)
+        if used > limit:
+            return text[:index] + ellipsis
+    return text + ellipsis
+
+
+def _format_table_row(row, column_count, max_cell_width):
+    if len(row) != column_count:
+        raise ValueError(f'Row has incorrect number of values, (actual) {len(row)}!={column_count} (expected)')
+    cells = [str(value).expandtabs().split('\n') for value in row]
+    if max_cell_width:
+        cells = [[_fit(line, max_cell_width) for line in cell] for cell in cells]
+    return cells
+
+
+def _iter_cell_lines(cells, widths):
+    height = max(len(cell) for cell in cells)
+    for y in range(height):
+        yield '| ' + ' | '.join(_center(cell[y] if y < len(cell) else '', width) for cell, width in zip(cells, widths)) + ' |'
+
+
+def iter_table_lines(rows, max_cell_width=0, head=None, tail=None, sample_size=0):
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    field_names = [str(field) for field in header]
+    if len(set(field_names)) != len(field_names):
+        raise ValueError(f'Field names must be unique, got {field_names}')
+    column_count = len(field_names)
+    body = (_format_table_row(row, column_count, max_cell_width) for row in rows)
+    if head is not None or tail is not None:
+        kept = list(islice(body, head or 0))
+        last = deque(maxlen=tail or 0)
+        omitted = 0
+        for cells in body:
+            last.append(cells)
+            omitted += 1
+        omitted -= len(last)
+        if omitted:
+            kept.append([[f'... {omitted} rows omitted ...' if index == 0 else '...'] for index in range(column_count)])
+        body = iter(kept + list(last))
+    if sample_size:
+        sampled = list(islice(body, sample_size))
+        body = chain(sampled, body)
+    else:
+        sampled = body = list(body)
+    header_cells = _format_table_row(field_names, column_count, 0)
+    widths = [max(_text_width(line) for line in cell) for cell in header_cells]
+    for cells in sampled:
+        for index, cell in enumerate(cells):
+            for line in cell:
+                line_width = _text_width(line)
+                if line_width > widths[index]:
+                    widths[index] = line_width
+    hrule = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+    yield hrule
+    yield from _iter_cell_lines(header_cells, widths)
+    yield hrule
+    for cells in body:
+        if sample_size:
+            cells = [[_fit(line, width) for line in cell] for cell, width in zip(cells, widths)]
+        yield from _iter_cell_lines(cells, widths)
+        yield hrule
 
 
 class CustomLogger:
@@ -18,8 +360,9 @@ class CustomLogger:
 
     console_logger_index = 0
     file_logger_index = 0
+    async_handlers = {}
 
-    def __init__(self, level=logging.DEBUG, to_console=True, to_file_name='', with_requests_logger=False, time_rotating=None, use_global_config=True):
+    def __init__(self, level=logging.DEBUG, to_console=True, to_file_name='', with_requests_logger=False, time_rotating=None, use_global_config=True, async_config=None, buffered_file=None):
 
         if use_global_config and CustomLogger.global_config_set:
             self.stdout_logger = CustomLogger.global_stdout_logger
@@ -27,6 +370,10 @@ class CustomLogger:
         else:
             if time_rotating is not None:
                 assert type(time_rotating) is dict and "when" in time_rotating and "interval" in time_rotating
+            if buffered_file is not None:
+                assert type(buffered_file) is dict and set(buffered_file) <= {"buffer_size", "max_bytes", "backup_count", "compress", "flush_interval"}
+            if async_config is not None:
+                assert type(async_config) is dict and set(async_config) <= {"capacity", "overflow", "batch_size"}
 
             if with_requests_logger:
                 self.stdout_logger = logging.getLogger("urllib3")
@@ -40,18 +387,37 @@ class CustomLogger:
             self.stderr_logger.propagate = False
             self.stderr_logger.setLevel(logging.ERROR)
 
+            stdout_handlers = []
+            stderr_handlers = []
             if to_console:
-                self.stdout_logger.addHandler(self.stdout_stream_handler)
-                self.stderr_logger.addHandler(self.stderr_stream_handler)
+                stdout_handlers.append(self.stdout_stream_handler)
+                stderr_handlers.append(self.stderr_stream_handler)
 
             if to_file_name:
-                if time_rotating is None:
+                if buffered_file is not None:
+                    file_handler = BufferedRotatingFileHandler(to_file_name, **buffered_file, **(time_rotating or {}))
+                elif time_rotating is None:
                     file_handler = logging.FileHandler(to_file_name, mode='w')
                 else:
                     file_handler = TimedRotatingFileHandler(filename=to_file_name, when=time_rotating['when'], interval=time_rotating['interval'])
                 file_handler.setFormatter(self.log_formatter)
-                self.stdout_logger.addHandler(file_handler)
-                self.stderr_logger.addHandler(file_handler)
+                stdout_handlers.append(file_handler)
+                stderr_handlers.append(file_handler)
+
+            if async_config is not None:
+                stdout_handlers = [self._async_handler(handler, async_config) for handler in stdout_handlers]
+                stderr_handlers = [self._async_handler(handler, async_config) for handler in stderr_handlers]
+            for handler in stdout_handlers:
+                self.stdout_logger.addHandler(handler)
+            for handler in stderr_handlers:
+                self.stderr_logger.addHandler(handler)
+
+    @classmethod
+    def _async_handler(cls, handler, async_config):
+        async_handler = cls.async_handlers.get(handler)
+        if async_handler is None or not async_handler.writer.is_alive():
+            async_handler = cls.async_handlers[handler] = AsyncLogHandler([handler], **async_config)
+        return async_handler
 
     def debug(self, msg):
         self.stdout_logger.debug(msg)
@@ -79,18 +445,26 @@ class Logger:
         Logger.logger.error(msg)
 
     @classmethod
-    def rows_to_table_string(cls, rows):
-        if len(rows) == 0:
-            return ''
-        table = PrettyTable()
-        table.field_names = rows[0]
-        for row in rows[1:]:
-            table.add_row(row)
-        return table.get_string(hrules=ALL)
+    def rows_to_table_string(cls, rows, max_cell_width=0, head=None, tail=None, sample_size=0):
+        return '\n'.join(iter_table_lines(rows, max_cell_width, head, tail, sample_size))
+
+    @classmethod
+    def write_table(cls, rows, stream=None, logger=None, level=logging.INFO, lines_per_record=1000, max_cell_width=0, head=None, tail=None, sample_size=0):
+        lines = iter_table_lines(rows, max_cell_width, head, tail, sample_size)
+        if logger is None:
+            stream = stream if stream is not None else sys.stdout
+            for line in lines:
+                stream.write(line + '\n')
+            return
+        while True:
+            batch = list(islice(lines, lines_per_record))
+            if not batch:
+                return
+            logger.log(level, '\n' + '\n'.join(batch))
 
     @classmethod
-    def set_global_config(cls, level=logging.DEBUG, to_console=True, to_file_name='', with_requests_logger=False, time_rotating=None):
-        logger = CustomLogger(level=level, to_console=to_console, to_file_name=to_file_name, with_requests_logger=with_requests_logger, time_rotating=time_rotating)
+    def set_global_config(cls, level=logging.DEBUG, to_console=True, to_file_name='', with_requests_logger=False, time_rotating=None, async_config=None, buffered_file=None):
+        logger = CustomLogger(level=level, to_console=to_console, to_file_name=to_file_name, with_requests_logger=with_requests_logger, time_rotating=time_rotating, async_config=async_config, buffered_file=buffered_file)
         CustomLogger.global_stdout_logger = logger.stdout_logger
         CustomLogger.global_stderr_logger = logger.stderr_logger
         CustomLogger.global_config_set = True
@@ -1,44 +1,684 @@
+from bisect import bisect_left
+import calendar
+from collections import OrderedDict
+import glob
+import hashlib
+import io
+import logging
+import mmap
 import os
 import pickle
+import sqlite3
 from datetime import timedelta, datetime
 import functools
+from itertools import islice
+import tempfile
+import threading
+import time
 import traceback
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from gevent import Timeout, sleep
 from gevent.timeout import Timeout as TimeoutException
 
 
-def get_variable_from_local(variable_name_with_path, default_value=None, function_value=None, args=None, kwds=None, keep_time=None, local_expire_datetime=None, force_refresh=False):
-    assert default_value or function_value
+class LocalVariableCache:
+
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, file_stat):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == (file_stat.st_mtime_ns, file_stat.st_size):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, path, file_stat, info_map, sidecar_bytes=0):
+        nbytes = file_stat.st_size + sidecar_bytes
+        with self.lock:
+            self._discard(path)
+            if (self.max_bytes and nbytes > self.max_bytes) or self.max_entries <= 0:
+                return
+            self.entries[path] = ((file_stat.st_mtime_ns, file_stat.st_size), info_map, nbytes)
+            self.total_bytes += nbytes
+            while len(self.entries) > self.max_entries or (self.max_bytes and self.total_bytes > self.max_bytes):
+                _, (_, _, evicted_bytes) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+
+    def _discard(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def discard(self, path):
+        with self.lock:
+            self._discard(path)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.total_bytes}
+
+
+local_variable_cache = LocalVariableCache()
+
+OUT_OF_BAND_THRESHOLD = 1024 * 1024
+SIDECAR_FORMAT = 'pickle5-mmap'
+SIDECAR_ALIGNMENT = 64
+_BLOB_TYPES = frozenset((bytes, bytearray))
+
+
+class _OutOfBandPickler(pickle.Pickler):
+
+    def __init__(self, file, buffer_callback, blobs):
+        pickle.Pickler.__init__(self, file, protocol=5, buffer_callback=buffer_callback)
+        self.blobs = blobs
+        self.blob_ids = {}
+
+    def persistent_id(self, obj):
+        if type(obj) not in _BLOB_TYPES or len(obj) < OUT_OF_BAND_THRESHOLD:
+            return None
+        index = self.blob_ids.get(id(obj))
+        if index is None:
+            index = self.blob_ids[id(obj)] = len(self.blobs)
+            self.blobs.append(obj)
+        return index
+
+
+class _OutOfBandUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, buffers, blobs):
+        pickle.Unpickler.__init__(self, file, buffers=buffers)
+        self.blobs = blobs
+
+    def persistent_load(self, pid):
+        return self.blobs[pid]
+
+
+def _read_local_variable(f, pkl_file_name):
+    info_map = pickle.load(f)
+    if not (isinstance(info_map, dict) and info_map.get("format") == SIDECAR_FORMAT):
+        return info_map, 0
+    buffers = []
+    blobs = []
+    with open(os.path.join(os.path.dirname(pkl_file_name), info_map["sidecar"]), 'rb') as sidecar:
+        sidecar_bytes = os.fstat(sidecar.fileno()).st_size
+        if info_map["buffers"]:
+            view = memoryview(mmap.mmap(sidecar.fileno(), 0, access=mmap.ACCESS_COPY))
+            buffers = [view[offset:offset + size] for offset, size in info_map["buffers"]]
+        for offset, size, kind in info_map.get("blobs", ()):
+            sidecar.seek(offset)
+            if kind == 'bytes':
+                blobs.append(sidecar.read(size))
+            else:
+                blobs.append(bytearray(size))
+                sidecar.readinto(blobs[-1])
+    return _OutOfBandUnpickler(f, buffers, blobs).load(), sidecar_bytes
+
+
+def _write_sidecar(sidecar_file_name, buffers):
+    layout = []
+    offset = 0
+    with open(sidecar_file_name, 'wb') as f:
+        for buffer in buffers:
+            raw = buffer.raw() if isinstance(buffer, pickle.PickleBuffer) else memoryview(buffer)
+            offset += -offset % SIDECAR_ALIGNMENT
+            f.seek(offset)
+            f.write(raw)
+            layout.append((offset, raw.nbytes))
+            offset += raw.nbytes
+    return layout
+
+
+def _remove_stale_sidecars(pkl_file_name, keep=None):
+    for sidecar_file_name in glob.glob(f'{glob.escape(pkl_file_name)}.*.buf'):
+        if sidecar_file_name != keep:
+            try:
+                os.unlink(sidecar_file_name)
+            except FileNotFoundError:
+                pass
+
+
+def load_local_variable(pkl_file_name, use_memory_cache=False):
+    try:
+        file_stat = os.stat(pkl_file_name)
+    except FileNotFoundError:
+        return None
+    if use_memory_cache:
+        info_map = local_variable_cache.get(pkl_file_name, file_stat)
+        if info_map is not None:
+            return info_map
+    try:
+        with open(pkl_file_name, 'rb') as f:
+            info_map, sidecar_bytes = _read_local_variable(f, pkl_file_name)
+    except FileNotFoundError:
+        return None
+    if use_memory_cache and os.stat(pkl_file_name).st_mtime_ns == file_stat.st_mtime_ns:
+        local_variable_cache.put(pkl_file_name, file_stat, info_map, sidecar_bytes)
+    return info_map
+
+
+def dump_local_variable(pkl_file_name, info_map, use_memory_cache=False, zero_copy=True):
+    buffers = []
+
+    def buffer_callback(buffer):
+        if buffer.raw().nbytes < OUT_OF_BAND_THRESHOLD:
+            return True
+        buffers.append(buffer)
+        return False
+
+    blobs = []
+    payload = None
+    if zero_copy and OUT_OF_BAND_THRESHOLD:
+        payload_file = io.BytesIO()
+        _OutOfBandPickler(payload_file, buffer_callback, blobs).dump(info_map)
+        payload = payload_file.getvalue()
+    sidecar_file_name = f'{pkl_file_name}.{uuid.uuid4().hex}.buf' if buffers or blobs else None
+    fd, tmp_file_name = tempfile.mkstemp(prefix=f'.{os.path.basename(pkl_file_name)}.', dir=os.path.dirname(pkl_file_name) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if sidecar_file_name:
+                layout = _write_sidecar(sidecar_file_name, buffers + blobs)
+                pickle.dump({"format": SIDECAR_FORMAT, "sidecar": os.path.basename(sidecar_file_name), "buffers": layout[:len(buffers)],
+                             "blobs": [(offset, size, type(blob).__name__) for (offset, size), blob in zip(layout[len(buffers):], blobs)]}, f)
+                f.write(payload)
+            elif payload is not None:
+                f.write(payload)
+            else:
+                pickle.dump(info_map, f)
+        os.replace(tmp_file_name, pkl_file_name)
+    except BaseException:
+        os.unlink(tmp_file_name)
+        if sidecar_file_name and os.path.exists(sidecar_file_name):
+            os.unlink(sidecar_file_name)
+        raise
+    _remove_stale_sidecars(pkl_file_name, sidecar_file_name)
+    if use_memory_cache:
+        local_variable_cache.put(pkl_file_name, os.stat(pkl_file_name), info_map, os.stat(sidecar_file_name).st_size if sidecar_file_name else 0)
+    return sidecar_file_name
+
+
+def retire_datetime_of(created_date, keep_time=None, local_expire_datetime=None):
+    if keep_time:
+        return created_date + timedelta(seconds=int(keep_time))
+    if local_expire_datetime:
+        return datetime.strptime(local_expire_datetime, '%Y-%m-%d %H:%M:%S')
+    return None
+
+
+def is_local_variable_fresh(info_map, keep_time=None, local_expire_datetime=None):
+    if info_map is None:
+        return False
+    retire_datetime = retire_datetime_of(info_map["created_date"], keep_time, local_expire_datetime)
+    return retire_datetime is None or datetime.now() <= retire_datetime
+
+
+class LocalVariableStore:
+
+    def __init__(self, root, max_bytes=0, shard_depth=2, eviction_interval=60.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.shard_depth = shard_depth
+        self.index_file_name = os.path.join(root, 'index.sqlite')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.touched = {}
+        self.shard_dirs = set()
+        self.stopped = threading.Event()
+        os.makedirs(root, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, file_name TEXT NOT NULL, '
+                     'size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL, expires_at REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)')
+        self.evictor = None
+        if eviction_interval:
+            self.evictor = threading.Thread(target=self._evict_periodically, args=(eviction_interval,),
+                                            name=f'local-variable-store-evictor-{id(self)}', daemon=True)
+            self.evictor.start()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.local.conn = sqlite3.connect(self.index_file_name, timeout=30, isolation_level=None)
+            self.local.pid = os.getpid()
+        return conn
+
+    def path_for(self, name):
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        shard_dir = os.path.join(self.root, *(digest[2 * i:2 * i + 2] for i in range(self.shard_depth)))
+        if shard_dir not in self.shard_dirs:
+            os.makedirs(shard_dir, exist_ok=True)
+            self.shard_dirs.add(shard_dir)
+        return os.path.join(shard_dir, f'{digest}.pkl')
+
+    def lookup(self, name):
+        row = self._connection().execute('SELECT created_at FROM entries WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        with self.lock:
+            self.touched[name] = time.time()
+        return datetime.fromtimestamp(row[0])
+
+    def record(self, name, file_name, created_date, sidecar_file_name=None, keep_time=None, local_expire_datetime=None):
+        size = os.stat(file_name).st_size + (os.stat(sidecar_file_name).st_size if sidecar_file_name else 0)
+        retire_datetime = retire_datetime_of(created_date, keep_time, local_expire_datetime)
+        self._connection().execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                                   (name, file_name, size, created_date.timestamp(), time.time(),
+                                    retire_datetime.timestamp() if retire_datetime else None))
+
+    def total_bytes(self):
+        return self._connection().execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self):
+        now = time.time()
+        with self.lock:
+            touched, self.touched = self.touched, {}
+        conn = self._connection()
+        conn.executemany('UPDATE entries SET accessed_at = MAX(accessed_at, ?) WHERE name = ?',
+                         [(accessed_at, name) for name, accessed_at in touched.items()])
+        victims = conn.execute('SELECT name, file_name, created_at FROM entries WHERE expires_at < ?', (now,)).fetchall()
+        if self.max_bytes:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries WHERE expires_at IS NULL OR expires_at >= ?', (now,)).fetchone()[0]
+            if total > self.max_bytes:
+                for name, file_name, created_at, size in conn.execute(
+                        'SELECT name, file_name, created_at, size FROM entries '
+                        'WHERE expires_at IS NULL OR expires_at >= ? ORDER BY accessed_at', (now,)).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    victims.append((name, file_name, created_at))
+                    total -= size
+        evicted = 0
+        for name, file_name, created_at in victims:
+            lock_file_name = _lock_file_name(file_name)
+            lock_file = _try_file_lock(lock_file_name)
+            if lock_file is None:
+                continue
+            try:
+                if not conn.execute('DELETE FROM entries WHERE name = ? AND created_at = ?', (name, created_at)).rowcount:
+                    continue
+                for victim_file_name in (file_name, lock_file_name):
+                    try:
+                        os.unlink(victim_file_name)
+                    except FileNotFoundError:
+                        pass
+                _remove_stale_sidecars(file_name)
+                local_variable_cache.discard(file_name)
+                evicted += 1
+            finally:
+                _release_file_lock(lock_file)
+        return evicted
+
+    def _evict_periodically(self, eviction_interval):
+        while not self.stopped.wait(eviction_interval):
+            try:
+                self.evict()
+            except Exception:
+                logging.error(f"Local variable store eviction failed: \n{traceback.format_exc()}")
+
+    def close(self):
+        self.stopped.set()
+        if self.evictor is not None:
+            self.evictor.join()
+        self.evict()
+
+
+default_local_variable_store = None
+
+
+def _resolve_local_variable(variable_name_with_path, store):
+    store = store if store is not None else default_local_variable_store
+    if store is None:
+        return f'{local_variable_path(variable_name_with_path)}.pkl', None
+    return store.path_for(variable_name_with_path), store
+
+
+def _load_fresh_local_variable(variable_name_with_path, pkl_file_name, store, keep_time, local_expire_datetime, use_memory_cache):
+    if store is not None:
+        created_date = store.lookup(variable_name_with_path)
+        if created_date is None or not is_local_variable_fresh({"created_date": created_date}, keep_time, local_expire_datetime):
+            return None
+    info_map = load_local_variable(pkl_file_name, use_memory_cache)
+    return info_map if is_local_variable_fresh(info_map, keep_time, local_expire_datetime) else None
+
+
+def _save_local_variable(variable_name_with_path, pkl_file_name, store, variable_value, keep_time, local_expire_datetime, use_memory_cache, zero_copy):
+    info_map = {"variable_value": variable_value, "created_date": datetime.now()}
+    sidecar_file_name = dump_local_variable(pkl_file_name, info_map, use_memory_cache, zero_copy)
+    if store is not None:
+        store.record(variable_name_with_path, pkl_file_name, info_map["created_date"], sidecar_file_name, keep_time, local_expire_datetime)
+
+
+def local_variable_path(variable_name_with_path):
     if "pkl_file_path" in os.environ:
         variable_name_with_path = f'{os.environ["pkl_file_path"]}/{variable_name_with_path}'
+    return variable_name_with_path
 
-    if (not force_refresh) and os.path.exists(f'{variable_name_with_path}.pkl'):
-        with open(f'{variable_name_with_path}.pkl', 'rb') as f:
-            info_map = pickle.load(f)
-        if keep_time or local_expire_datetime:
-            retire_datetime = info_map["created_date"] + timedelta(seconds=int(keep_time)) if keep_time else datetime.strptime(local_expire_datetime, '%Y-%m-%d %H:%M:%S')
-            current_time = datetime.now()
-            if current_time <= retire_datetime:
-                return info_map["variable_value"]
-        else:
-            return info_map["variable_value"]
+
+def get_variable_from_local(variable_name_with_path, default_value=None, function_value=None, args=None, kwds=None, keep_time=None, local_expire_datetime=None, force_refresh=False, use_memory_cache=False, zero_copy=True, store=None):
+    assert default_value or function_value
+    pkl_file_name, store = _resolve_local_variable(variable_name_with_path, store)
+
+    info_map = None if force_refresh else _load_fresh_local_variable(variable_name_with_path, pkl_file_name, store, keep_time, local_expire_datetime, use_memory_cache)
+    if info_map is not None:
+        return info_map["variable_value"]
     if args is None:
         args = ()
     if kwds is None:
         kwds = {}
     variable_value = default_value if default_value else function_value(*args, **kwds)
-    with open(f'{variable_name_with_path}.pkl', 'wb') as f:
-        pickle.dump({"variable_value": variable_value, "created_date": datetime.now()}, f)
+    lock_file = _acquire_file_lock(_lock_file_name(pkl_file_name), 0.01) if store is not None else None
+    try:
+        _save_local_variable(variable_name_with_path, pkl_file_name, store, variable_value, keep_time, local_expire_datetime, use_memory_cache, zero_copy)
+    finally:
+        if lock_file is not None:
+            _release_file_lock(lock_file)
     return variable_value
 
 
-def date_range(start_date, end_date, including_end_date=False):
-    for n in range(int((end_date - start_date).days) + (1 if including_end_date else 0)):
-        yield start_date + timedelta(n)
+_in_flight_lock = threading.Lock()
+_in_flight = {}
+
+
+def _lock_file_name(pkl_file_name):
+    return f'{pkl_file_name[:-len(".pkl")]}.lock'
+
+
+def _try_file_lock(lock_file_name):
+    f = open(lock_file_name, 'a')
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    try:
+        if os.path.samestat(os.fstat(f.fileno()), os.stat(lock_file_name)):
+            return f
+    except FileNotFoundError:
+        pass
+    _release_file_lock(f)
+    return None
+
+
+def _acquire_file_lock(lock_file_name, poll_interval):
+    while True:
+        f = _try_file_lock(lock_file_name)
+        if f is not None:
+            return f
+        sleep(poll_interval)
+
+
+def _release_file_lock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    f.close()
+
+
+def local_cached(keep_time=None, local_expire_datetime=None, name=None, poll_interval=0.01, use_memory_cache=False, zero_copy=True, store=None):
+
+    def decorator(func):
+        prefix = name if name else f'{func.__module__}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            digest = hashlib.sha256(pickle.dumps((args, sorted(kwargs.items())), protocol=4)).hexdigest()[:32]
+            variable_name_with_path = f'{prefix}.{digest}'
+            pkl_file_name, resolved_store = _resolve_local_variable(variable_name_with_path, store)
+            while True:
+                info_map = _load_fresh_local_variable(variable_name_with_path, pkl_file_name, resolved_store, keep_time, local_expire_datetime, use_memory_cache)
+                if info_map is not None:
+                    return info_map["variable_value"]
+                with _in_flight_lock:
+                    done = _in_flight.get(pkl_file_name)
+                    leader = done is None
+                    if leader:
+                        done = _in_flight[pkl_file_name] = threading.Event()
+                if leader:
+                    break
+                while not done.is_set():
+                    sleep(poll_interval)
+            try:
+                lock_file = _acquire_file_lock(_lock_file_name(pkl_file_name), poll_interval)
+                try:
+                    info_map = _load_fresh_local_variable(variable_name_with_path, pkl_file_name, resolved_store, keep_time, local_expire_datetime, use_memory_cache)
+                    if info_map is not None:
+                        return info_map["variable_value"]
+                    variable_value = func(*args, **kwargs)
+                    _save_local_variable(variable_name_with_path, pkl_file_name, resolved_store, variable_value, keep_time, local_expire_datetime, use_memory_cache, zero_copy)
+                    return variable_value
+                finally:
+                    _release_file_lock(lock_file)
+            finally:
+                with _in_flight_lock:
+                    _in_flight.pop(pkl_file_name, None)
+                done.set()
+
+        return wrapper
+
+    return decorator
+
+
+def add_months(value, months):
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+class DateRange:
+
+    __slots__ = ('start', 'step', 'months', 'offset', 'count', 'exclude', 'excluded_indices')
+
+    def __init__(self, start, end, including_end=False, step=None, months=0, exclude=None):
+        assert months >= 0 and not (months and step)
+        self.start = start
+        self.months = months
+        self.step = None if months else (step if step is not None else timedelta(days=1))
+        assert months or self.step > timedelta(0)
+        assert months or isinstance(start, datetime) or not self.step % timedelta(days=1)
+        self.offset = 0
+        if months:
+            steps = ((end.year - start.year) * 12 + end.month - start.month) // months + 1
+            while steps >= 0 and add_months(start, steps * months) > end:
+                steps -= 1
+        else:
+            steps = (end - start) // self.step
+        self.count = max(0, steps + (1 if including_end else 0))
+        self.exclude = frozenset(exclude) if exclude else frozenset()
+        self.excluded_indices = self._excluded_indices() if self.exclude else []
+
+    def _base(self, k):
+        if self.months:
+            return add_months(self.start, (self.offset + k) * self.months)
+        return self.start + (self.offset + k) * self.step
+
+    def _is_excluded(self, value):
+        return value in self.exclude or (isinstance(value, datetime) and value.date() in self.exclude)
+
+    def _excluded_indices(self):
+        if self.months:
+            return [k for k in range(self.count) if self._is_excluded(self._base(k))]
+        first_value = self._base(0)
+        indices = set()
+        for item in self.exclude:
+            if isinstance(first_value, datetime) and not isinstance(item, datetime):
+                day_start = datetime.combine(item, datetime.min.time(), first_value.tzinfo)
+                first = -((first_value - day_start) // self.step)
+                last = -((first_value - day_start - timedelta(days=1)) // self.step)
+                indices.update(range(max(first, 0), min(last, self.count)))
+            elif isinstance(item, datetime) == isinstance(first_value, datetime):
+                offset = item - first_value
+                if not offset % self.step and 0 <= offset // self.step < self.count:
+                    indices.add(offset // self.step)
+        return sorted(indices)
+
+    def _base_index(self, position):
+        k = position
+        for excluded in self.excluded_indices:
+            if excluded > k:
+                break
+            k += 1
+        return k
+
+    def __len__(self):
+        return self.count - len(self.excluded_indices)
+
+    def __iter__(self):
+        excluded = set(self.excluded_indices)
+        if self.months:
+            for k in range(self.count):
+                if k not in excluded:
+                    yield self._base(k)
+            return
+        value = self._base(0)
+        for k in range(self.count):
+            if k not in excluded:
+                yield value
+            value += self.step
+
+    def __getitem__(self, position):
+        length = len(self)
+        if position < 0:
+            position += length
+        if not 0 <= position < length:
+            raise IndexError('DateRange index out of range')
+        return self._base(self._base_index(position))
+
+    def __contains__(self, value):
+        if self.count == 0 or self._is_excluded(value):
+            return False
+        if self.months:
+            first = self._base(0)
+            k = ((value.year - first.year) * 12 + value.month - first.month) // self.months
+            return 0 <= k < self.count and self._base(k) == value
+        try:
+            offset = value - self._base(0)
+        except TypeError:
+            return False
+        return not offset % self.step and 0 <= offset // self.step < self.count
+
+    def __repr__(self):
+        step = f'months={self.months}' if self.months else f'step={self.step!r}'
+        return f'DateRange({self[0] if len(self) else self._base(0)!r}, len={len(self)}, {step}, excluded={len(self.excluded_indices)})'
+
+    def _window(self, first_k, stop_k):
+        window = DateRange.__new__(DateRange)
+        window.start = self.start
+        window.step = self.step
+        window.months = self.months
+        window.offset = self.offset + first_k
+        window.count = stop_k - first_k
+        window.exclude = self.exclude
+        window.excluded_indices = [k - first_k for k in self.excluded_indices[bisect_left(self.excluded_indices, first_k):bisect_left(self.excluded_indices, stop_k)]]
+        return window
+
+    def windows(self, n=None, size=None):
+        assert (n is None) != (size is None)
+        length = len(self)
+        if size is not None:
+            bounds = list(range(0, length, size)) + [length]
+        else:
+            n = max(1, min(n, length))
+            bounds = [length * index // n for index in range(n + 1)]
+        return [self._window(self._base_index(first), self._base_index(stop - 1) + 1)
+                for first, stop in zip(bounds, bounds[1:]) if stop > first]
+
+    def to_numpy(self):
+        if np is None:
+            raise ImportError('numpy is required for DateRange.to_numpy')
+        if self.months:
+            return np.array(list(self), dtype='datetime64[D]' if not isinstance(self.start, datetime) else 'datetime64[us]')
+        step = np.timedelta64(self.step) if isinstance(self.start, datetime) else np.timedelta64(self.step.days, 'D')
+        values = np.datetime64(self._base(0)) + np.arange(self.count) * step
+        return np.delete(values, self.excluded_indices) if self.excluded_indices else values
+
+
+def date_range(start_date, end_date, including_end_date=False, step=None, months=0, exclude=None):
+    yield from DateRange(start_date, end_date, including_end_date, step, months, exclude)
+
+def sql_quote(value, backslash_escapes=False):
+    text = str(value)
+    if backslash_escapes:
+        text = text.replace('\\', '\\\\')
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _escape_sql_values(values, backslash_escapes):
+    if backslash_escapes:
+        return [str(value).replace('\\', '\\\\').replace("'", "''") for value in values]
+    return [str(value).replace("'", "''") for value in values]
+
+
+def iter_in_clauses(values, chunk_size=1000, max_bytes=0, keep_order=True, dedupe=True, backslash_escapes=False):
+    if dedupe and not keep_order:
+        values = set(values)
+    elif dedupe:
+        values = dict.fromkeys(values) if isinstance(values, (list, tuple)) else _unique_everseen(values)
+    iterator = iter(values)
+    if not max_bytes:
+        while True:
+            batch = list(islice(iterator, chunk_size)) if chunk_size else list(iterator)
+            if not batch:
+                return
+            yield "('" + "','".join(_escape_sql_values(batch, backslash_escapes)) + "')"
+    chunk = []
+    chunk_bytes = 2
+    for value in iterator:
+        quoted = sql_quote(value, backslash_escapes)
+        quoted_bytes = (len(quoted) if quoted.isascii() else len(quoted.encode('utf-8'))) + (1 if chunk else 0)
+        if chunk and ((chunk_size and len(chunk) >= chunk_size) or chunk_bytes + quoted_bytes > max_bytes):
+            yield '(' + ','.join(chunk) + ')'
+            chunk = []
+            chunk_bytes = 2
+            quoted_bytes -= 1
+        chunk.append(quoted)
+        chunk_bytes += quoted_bytes
+    if chunk:
+        yield '(' + ','.join(chunk) + ')'
+
+
+def _unique_everseen(values):
+    seen = set()
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            yield value
+
+
+def map_in_clauses(pool, func, values, window=0, raise_exception=False, with_status=False, **kwargs):
+    return pool.map(func, iter_in_clauses(values, **kwargs), window=window, raise_exception=raise_exception, with_status=with_status)
+
 
 def list_to_string(a_list):
-    return "('" + "','".join(set(a_list)) + "')"
+    return next(iter_in_clauses(a_list, chunk_size=0), "('')")
+
 
 def set_to_string(a_set):
-    return "('" + "','".join(a_set) + "')"
+    return next(iter_in_clauses(a_set, chunk_size=0, dedupe=False), "('')")
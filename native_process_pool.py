@@ -0,0 +1,116 @@
+import functools
+import multiprocessing
+import threading
+import traceback
+
+from native_thread_pool import NativeThreadPool, apply_chunk
+
+
+class RemoteTraceback(Exception):
+
+    def __init__(self, tb):
+        Exception.__init__(self, tb)
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+def _process_entry(conn, func, args, kwargs):
+    try:
+        res = func(*args, **kwargs)
+        success = True
+        tb = None
+    except Exception as e:
+        res = e
+        success = False
+        tb = traceback.format_exc()
+    try:
+        conn.send((success, res, tb))
+    except Exception:
+        conn.send((False, RuntimeError(f'Unpicklable result: {res!r}'), traceback.format_exc()))
+    conn.close()
+
+
+class NativeProcessPool(NativeThreadPool):
+
+    __slots__ = ('mp_context', 'processes', 'process_lock')
+
+    def __init__(self, **kwargs):
+        NativeThreadPool.__init__(self, **kwargs)
+        mp_context = kwargs.get('mp_context')
+        if mp_context is None:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+            mp_context = multiprocessing.get_context(start_method)
+        self.mp_context = mp_context
+        self.processes = {}
+        self.process_lock = threading.Lock()
+
+    def start_thread(self, thread_number, func, args, kwargs, holds_slot=True, lease=None, call=None):
+        if call is not None and not holds_slot:
+            return NativeThreadPool.start_thread(self, thread_number, func, args, kwargs, holds_slot, lease, call)
+
+        @functools.wraps(func)
+        def run_in_process(*args, **kwargs):
+            return self._run_in_process(thread_number, func, args, kwargs)
+
+        NativeThreadPool.start_thread(self, thread_number, run_in_process, args, kwargs, holds_slot, lease, call)
+
+    def _apply_chunk(self, func, chunk):
+        return self._run_in_process(object(), apply_chunk, (func, chunk), {})
+
+    def _run_in_process(self, thread_number, func, args, kwargs):
+        parent_conn, child_conn = self.mp_context.Pipe(duplex=False)
+        process = self.mp_context.Process(target=_process_entry, daemon=True, args=(child_conn, func, args, kwargs))
+        with self.process_lock:
+            if thread_number in self.killed_threads:
+                raise SystemExit
+            process.start()
+            self.processes[thread_number] = process
+        child_conn.close()
+        try:
+            message = parent_conn.recv()
+        except EOFError:
+            process.join()
+            if thread_number in self.killed_threads:
+                raise SystemExit
+            raise RuntimeError(f'Process of thread {thread_number} exited with code {process.exitcode}')
+        finally:
+            parent_conn.close()
+            with self.process_lock:
+                self.processes.pop(thread_number, None)
+        process.join()
+        success, res, tb = message
+        if success:
+            return res
+        res.__cause__ = RemoteTraceback(tb)
+        raise res
+
+    def new_shared_pool(self, exit_for_any_exception=False, max_thread=0, weight=1, min_threads=0, name=None):
+        return NativeProcessPool(semaphore=self._shared_semaphore(weight, min_threads, name), exit_for_any_exception=exit_for_any_exception,
+                                 max_thread=max_thread if max_thread > 0 else self.max_thread,
+                                 persistent_workers=self.persistent_workers, mp_context=self.mp_context,
+                                 backlog_capacity=self.backlog.maxsize if self.backlog is not None else 0,
+                                 overflow_policy=self.overflow_policy, long_running=self.long_running,
+                                 metrics=self.metrics is not None,
+                                 fair_share=self.fair_share, prioritized=self.prioritized,
+                                 aging_seconds=self.aging_seconds, rate_limiter=self.rate_limiter,
+                                 concurrency_controller=self.concurrency_controller, coalescer=self.coalescer)
+
+    def _cancel(self, thread_number, handle):
+        with self.process_lock:
+            process = self.processes.get(thread_number)
+        if process is not None:
+            process.terminate()
+
+    def stop_nth_thread(self, n):
+        with self.process_lock:
+            if n in self.completed_threads or (self.long_running and n not in self.thread_list):
+                return
+            self.completed_threads.add(n)
+            self.killed_threads.add(n)
+            if self.long_running:
+                self.thread_list.pop(n)
+            process = self.processes.get(n)
+        if process is not None:
+            process.terminate()
@@ -1,10 +1,20 @@
 import ctypes
+import itertools
 import logging
 import os
-from queue import Queue
+from queue import Empty, Full, PriorityQueue, Queue, SimpleQueue
 import traceback
 import threading
 from threading import BoundedSemaphore
+import time
+
+from pool_adaptive import AimdController
+from pool_deadlines import DeadlineTimer, TaskLease
+from pool_dedup import CallCoalescer
+from pool_exceptions import PoolFullError, TaskDroppedError, TaskTimeoutError
+from pool_metrics import PoolMetrics
+from pool_rate_limit import TokenBucket
+from pool_scheduling import FairScheduler, FairShare, priority_key
 
 
 class ThreadWithException(threading.Thread):
@@ -26,88 +36,585 @@ class ThreadWithException(threading.Thread):
             raise SystemError('PyThreadState_SetAsyncExc failed')
 
 
+def apply_chunk(func, chunk):
+    results = []
+    for item in chunk:
+        try:
+            results.append((True, func(item)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class PooledTask:
+
+    __slots__ = ('target', 'args', 'worker', 'state_lock', 'done')
+
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+        self.worker = None
+        self.state_lock = threading.Lock()
+        self.done = threading.Event()
+
+    def run(self):
+        with self.state_lock:
+            self.worker = threading.current_thread()
+        try:
+            self.target(*self.args)
+        finally:
+            while True:
+                try:
+                    with self.state_lock:
+                        self.worker = None
+                    self.done.set()
+                    break
+                except SystemExit:
+                    continue
+
+    def kill(self):
+        with self.state_lock:
+            if self.worker is not None:
+                self.worker.kill()
+
+    def join(self, timeout=None):
+        self.done.wait(timeout)
+
+    def is_alive(self):
+        return not self.done.is_set()
+
+
+class FollowerTask:
+
+    __slots__ = ('call', 'lease', 'deliver', 'done')
+
+    def __init__(self, call, lease, deliver):
+        self.call = call
+        self.lease = lease
+        self.deliver = deliver
+        self.done = threading.Event()
+
+    def resolve(self, success, res):
+        if self.lease is not None and not self.lease.settle():
+            return False
+        self.deliver(success, res)
+        self.done.set()
+        return True
+
+    def kill(self):
+        pass
+
+    def join(self, timeout=None):
+        self.done.wait(timeout)
+
+    def is_alive(self):
+        return not self.done.is_set()
+
+
+class PriorityBacklog(PriorityQueue):
+
+    def _get(self):
+        return PriorityQueue._get(self)[1]
+
+
 class NativeThreadPool:
 
     __slots__ = ('max_thread', 'main_semaphore', 'sub_semaphore', 'exit_for_any_exception',
                  '_thread_res_queue', 'valid_for_new_thread', 'log_exception', 'thread_list',
-                 'completed_threads', 'killed_threads')
+                 'completed_threads', 'killed_threads', 'persistent_workers', 'workers', '_task_queue',
+                 'backlog', 'overflow_policy', 'dispatcher', 'submit_lock', 'long_running', 'task_counter',
+                 'metrics', 'fair_share', 'prioritized', 'aging_seconds', 'deadline', 'deadline_timer',
+                 'rate_limiter', 'concurrency_controller', 'coalescer', 'follower_timer')
 
     def __init__(self, **kwargs):
         assert 'total_thread_number' in kwargs or ('semaphore' in kwargs and 'max_thread' in kwargs)
+        self.fair_share = kwargs.get('fair_share', False)
+        self.prioritized = kwargs.get('prioritized', False)
+        self.aging_seconds = kwargs.get('aging_seconds', 10.0)
+        self.rate_limiter = kwargs.get('rate_limiter')
+        if self.rate_limiter is None and kwargs.get('rate_limit', 0) > 0:
+            self.rate_limiter = TokenBucket(kwargs['rate_limit'], kwargs.get('burst', 0), time.sleep)
         if 'total_thread_number' in kwargs:
             self.max_thread = kwargs['total_thread_number']
-            self.main_semaphore = BoundedSemaphore(self.max_thread)
-            self.sub_semaphore = BoundedSemaphore(self.max_thread)
+            if self.fair_share or self.prioritized or kwargs.get('adaptive', False):
+                self.main_semaphore = FairScheduler(self.max_thread, threading.Event, self.aging_seconds).tenant(kwargs.get('weight', 1), kwargs.get('min_threads', 0), kwargs.get('name', 'root'))
+            else:
+                self.main_semaphore = BoundedSemaphore(self.max_thread)
         else:
             self.max_thread = kwargs['max_thread']
             self.main_semaphore = kwargs['semaphore']
+        if self.prioritized:
+            self.sub_semaphore = FairScheduler(self.max_thread, threading.Event, self.aging_seconds).tenant(name='sub')
+        else:
             self.sub_semaphore = BoundedSemaphore(self.max_thread)
+        self.concurrency_controller = kwargs.get('concurrency_controller')
+        if self.concurrency_controller is None and kwargs.get('adaptive', False):
+            assert isinstance(self.main_semaphore, FairShare)
+            self.concurrency_controller = AimdController(self.main_semaphore.scheduler, kwargs.get('min_concurrency', 1), self.max_thread,
+                                                         kwargs.get('initial_concurrency', 0), kwargs.get('adaptive_window', 0))
         self.exit_for_any_exception = kwargs.get("exit_for_any_exception", False)
         self._thread_res_queue = Queue()
         self.valid_for_new_thread = True
         self.log_exception = kwargs.get('log_exception', True)
-        self.thread_list = []
+        self.long_running = kwargs.get('long_running', False)
+        self.thread_list = {} if self.long_running else []
+        self.task_counter = 0
+        self.metrics = PoolMetrics(self.max_thread) if kwargs.get('metrics', False) else None
         self.completed_threads = set()
         self.killed_threads = set()
+        self.persistent_workers = kwargs.get('persistent_workers', False)
+        self.workers = []
+        self._task_queue = SimpleQueue()
+        backlog_capacity = kwargs.get('backlog_capacity', 0)
+        if backlog_capacity > 0:
+            self.backlog = PriorityBacklog(backlog_capacity) if self.prioritized else Queue(backlog_capacity)
+        else:
+            self.backlog = None
+        self.overflow_policy = kwargs.get('overflow_policy', 'block')
+        assert self.overflow_policy in ('block', 'raise', 'drop_oldest', 'caller_runs')
+        assert not (self.prioritized and self.backlog is not None and self.overflow_policy == 'drop_oldest')
+        self.dispatcher = None
+        self.submit_lock = threading.Lock()
+        self.deadline = None
+        self.deadline_timer = DeadlineTimer(self._expire, self._spawn_daemon)
+        self.coalescer = kwargs.get('coalescer')
+        if self.coalescer is None and kwargs.get('dedup_key') is not None:
+            self.coalescer = CallCoalescer(kwargs['dedup_key'], threading.Event)
+        assert self.coalescer is None or self.backlog is None
+        self.follower_timer = DeadlineTimer(self._expire_follower, self._spawn_daemon)
 
-    def start_thread(self, thread_number, func, args, kwargs):
+    def start_thread(self, thread_number, func, args, kwargs, holds_slot=True, lease=None, call=None):
         success = True
+        finished = False
         res = None
+        follows = call is not None and not holds_slot
+        metrics = self.metrics if not follows else None
+        started_at = metrics.task_started(thread_number) if metrics is not None else time.perf_counter()
         main_semaphore = self.main_semaphore
         sub_semaphore = self.sub_semaphore
         thread_res_queue = self._thread_res_queue
         completed_threads = self.completed_threads
         killed_threads = self.killed_threads
         try:
+            if thread_number in killed_threads or (lease is not None and lease.finished):
+                return
             res = func(*args, **kwargs)
+            finished = True
         except Exception as e:
             res = e
-            err_msg = traceback.format_exc()
-            if self.log_exception:
-                logging.error(f"Thread {thread_number} failed when execute {func.__name__}, error msg: \n{err_msg}")
-            if self.exit_for_any_exception:
-                os._exit(-1)
+            if (lease is None or not lease.finished) and not follows:
+                err_msg = traceback.format_exc()
+                if self.log_exception:
+                    logging.error(f"Thread {thread_number} failed when execute {func.__name__}, error msg: \n{err_msg}")
+                if self.exit_for_any_exception:
+                    os._exit(-1)
 
             success = False
+            finished = True
         finally:
-            logging.info(f'main_semaphore.release(): {thread_number}')
-            main_semaphore.release()
-            sub_semaphore.release()
-            completed_threads.add(thread_number)
-            if thread_number not in killed_threads:
-                thread_res_queue.put((thread_number, success, res))
+            if metrics is not None:
+                metrics.task_finished(started_at, success, not finished)
+            settled = lease is None or lease.settle()
+            if call is not None and not follows:
+                if finished:
+                    self.coalescer.finish(call, success, res)
+                elif not settled:
+                    self.coalescer.finish(call, False, TaskTimeoutError(f'Thread {thread_number} timed out'))
+                else:
+                    self.coalescer.drop(call)
+            if settled:
+                if lease is not None:
+                    self.deadline_timer.discard()
+                if finished and not follows and self.concurrency_controller is not None:
+                    self.concurrency_controller.observe(time.perf_counter() - started_at, success)
+                if holds_slot:
+                    logging.info('main_semaphore.release(): %s', thread_number)
+                    main_semaphore.release()
+                    sub_semaphore.release()
+                completed_threads.add(thread_number)
+                if thread_number not in killed_threads:
+                    thread_res_queue.put((thread_number, success, res))
+                elif self.long_running:
+                    self._release_record(thread_number)
+
+    def apply_async(self, func, args=None, kwargs=None, priority=0, timeout=None):
+        assert self.valid_for_new_thread
+        if args is None:
+            args = tuple()
+        if kwargs is None:
+            kwargs = dict()
+        call = None
+        if self.coalescer is not None:
+            call, leads = self.coalescer.join(func, args, kwargs)
+            if not leads:
+                return self._follow(call, func, args, kwargs, timeout)
+        if self.backlog is not None:
+            return self._enqueue(func, args, kwargs, self.overflow_policy, priority, timeout)
+        logging.info('main_semaphore.acquire(): %s', self.task_counter)
+        submitted_at = time.perf_counter() if self.metrics is not None else None
+        self._acquire_slot(priority)
+        thread_number = self._new_thread_number()
+        if self.metrics is not None:
+            self.metrics.task_submitted(thread_number, submitted_at)
+        lease = self._new_lease(thread_number, timeout)
+        thread = self._new_handle(self.start_thread, (thread_number, func, args, kwargs, True, lease, call))
+        self._track(thread_number, thread)
+        self._start_lease(lease, thread)
+        self._start(thread)
+        return thread
 
-    def apply_async(self, func, args=None, kwargs=None):
+    def try_apply_async(self, func, args=None, kwargs=None, priority=0, timeout=None):
         assert self.valid_for_new_thread
-        logging.info(f'main_semaphore.acquire(): {len(self.thread_list)}')
-        self.main_semaphore.acquire()
-        self.sub_semaphore.acquire()
         if args is None:
             args = tuple()
         if kwargs is None:
             kwargs = dict()
-        thread = ThreadWithException(target=self.start_thread, args=(len(self.thread_list), func, args, kwargs))
-        self.thread_list.append(thread)
-        thread.start()
+        call = None
+        if self.coalescer is not None:
+            call, leads = self.coalescer.join(func, args, kwargs)
+            if not leads:
+                return self._follow(call, func, args, kwargs, timeout)
+        if self.backlog is not None:
+            try:
+                return self._enqueue(func, args, kwargs, 'raise', priority, timeout)
+            except PoolFullError:
+                return None
+        if not self._acquire_slot(priority, blocking=False):
+            if call is not None:
+                self.coalescer.withdraw(call)
+            return None
+        thread_number = self._new_thread_number()
+        if self.metrics is not None:
+            self.metrics.task_submitted(thread_number)
+        lease = self._new_lease(thread_number, timeout)
+        thread = self._new_handle(self.start_thread, (thread_number, func, args, kwargs, True, lease, call))
+        self._track(thread_number, thread)
+        self._start_lease(lease, thread)
+        self._start(thread)
         return thread
 
-    def new_shared_pool(self, exit_for_any_exception=False, max_thread=0):
-        return NativeThreadPool(semaphore=self.main_semaphore, exit_for_any_exception=exit_for_any_exception,
-                                max_thread=max_thread if max_thread > 0 else self.max_thread)
+    def _follow(self, call, func, args, kwargs, timeout):
+        thread_number = self._new_thread_number()
+        thread_res_queue = self._thread_res_queue
+        completed_threads = self.completed_threads
+        killed_threads = self.killed_threads
+
+        def deliver(success, res):
+            completed_threads.add(thread_number)
+            if thread_number not in killed_threads:
+                thread_res_queue.put((thread_number, success, res))
+            elif self.long_running:
+                self._release_record(thread_number)
+
+        task = FollowerTask(call, TaskLease(thread_number, timeout, thread_res_queue) if timeout is not None else None, deliver)
+        self._track(thread_number, task)
+        if task.lease is not None:
+            task.lease.handle = task
+            self.follower_timer.schedule(task.lease)
+        call.add_callback(lambda success, res: self._resolve_follower(task, success, res))
+        return task
+
+    def _resolve_follower(self, task, success, res):
+        if task.resolve(success, res) and task.lease is not None:
+            self.follower_timer.discard()
+
+    @staticmethod
+    def _expire_follower(lease):
+        task = lease.handle
+        task.resolve(False, TaskTimeoutError(f'Timed out waiting for in-flight call {task.call.key!r}'))
+
+    def _acquire_slot(self, priority=0, blocking=True):
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(blocking):
+            return False
+        if isinstance(self.main_semaphore, FairShare):
+            acquired = self.main_semaphore.acquire(blocking, priority=priority)
+        else:
+            acquired = self.main_semaphore.acquire(blocking=blocking)
+        if acquired:
+            if self.prioritized:
+                acquired = self.sub_semaphore.acquire(blocking, priority=priority)
+            else:
+                acquired = self.sub_semaphore.acquire(blocking=blocking)
+            if not acquired:
+                self.main_semaphore.release()
+        if not acquired and self.rate_limiter is not None:
+            self.rate_limiter.release()
+        return acquired
+
+    def set_deadline(self, seconds):
+        self.deadline = time.perf_counter() + seconds if seconds is not None else None
+
+    def _new_lease(self, thread_number, timeout):
+        if timeout is None and self.deadline is None:
+            return None
+        return TaskLease(thread_number, timeout, self._thread_res_queue)
+
+    def _start_lease(self, lease, handle):
+        if lease is not None:
+            lease.handle = handle
+            self.deadline_timer.schedule(lease, self.deadline)
+
+    def _expire(self, lease):
+        if not lease.settle():
+            return
+        thread_number = lease.thread_number
+        if self.concurrency_controller is not None:
+            self.concurrency_controller.observe(time.perf_counter() - lease.started_at, False)
+        logging.info('main_semaphore.release() on timeout: %s', thread_number)
+        self.main_semaphore.release()
+        self.sub_semaphore.release()
+        if lease.result_queue is self._thread_res_queue:
+            self.completed_threads.add(thread_number)
+            if thread_number not in self.killed_threads:
+                lease.result_queue.put((thread_number, False, TaskTimeoutError(f'Thread {thread_number} timed out')))
+            elif self.long_running:
+                self._release_record(thread_number)
+        self._cancel(thread_number, lease.handle)
+
+    def _cancel(self, thread_number, handle):
+        if isinstance(handle, PooledTask):
+            with handle.state_lock:
+                worker = handle.worker
+            if worker in self.workers:
+                self.workers.remove(worker)
+        handle.kill()
+
+    @staticmethod
+    def _spawn_daemon(target):
+        ThreadWithException(target=target, daemon=True).start()
+
+    def _new_thread_number(self):
+        thread_number = self.task_counter
+        self.task_counter += 1
+        return thread_number
+
+    def _track(self, thread_number, thread):
+        if self.long_running:
+            self.thread_list[thread_number] = thread
+        else:
+            self.thread_list.append(thread)
+
+    def _release_record(self, thread_number):
+        self.thread_list.pop(thread_number, None)
+        self.completed_threads.discard(thread_number)
+        self.killed_threads.discard(thread_number)
+
+    def _pending_result_count(self):
+        if self.long_running:
+            return len(self.thread_list)
+        return len(self.thread_list) - len(self.killed_threads)
+
+    def _enqueue(self, func, args, kwargs, overflow_policy, priority=0, timeout=None):
+        run_in_caller = False
+        with self.submit_lock:
+            thread_number = self._new_thread_number()
+            task = PooledTask(self.start_thread, (thread_number, func, args, kwargs, True, self._new_lease(thread_number, timeout)))
+            self._track(thread_number, task)
+            if self.metrics is not None:
+                self.metrics.task_submitted(thread_number)
+            item = (priority_key(priority, self.aging_seconds), task) if self.prioritized else task
+            while overflow_policy != 'block':
+                try:
+                    self.backlog.put(item, block=False)
+                    break
+                except Full:
+                    if overflow_policy == 'raise':
+                        if self.metrics is not None:
+                            self.metrics.task_discarded(thread_number, killed=False)
+                        if self.long_running:
+                            self.thread_list.pop(thread_number)
+                        else:
+                            self.thread_list.pop()
+                            self.task_counter -= 1
+                        raise PoolFullError(f'Backlog is full with {self.backlog.maxsize} pending tasks')
+                    if overflow_policy == 'caller_runs':
+                        run_in_caller = True
+                        break
+                try:
+                    self._drop(self.backlog.get_nowait())
+                except Empty:
+                    pass
+        if overflow_policy == 'block':
+            self.backlog.put(item)
+        if run_in_caller:
+            task.args = (thread_number, func, args, kwargs, False)
+            task.run()
+            return task
+        if self.dispatcher is None:
+            self.dispatcher = ThreadWithException(target=self._dispatch, daemon=True)
+            self.dispatcher.start()
+        return task
+
+    def _drop(self, task):
+        thread_number = task.args[0]
+        if self.metrics is not None:
+            self.metrics.task_discarded(thread_number, killed=thread_number in self.killed_threads)
+        if thread_number not in self.killed_threads:
+            self.completed_threads.add(thread_number)
+            self._thread_res_queue.put((thread_number, False, TaskDroppedError(f'Thread {thread_number} dropped from backlog')))
+        elif self.long_running:
+            self._release_record(thread_number)
+        task.done.set()
+
+    def _dispatch(self):
+        while True:
+            task = self.backlog.get()
+            if task.args[0] in self.killed_threads:
+                if self.metrics is not None:
+                    self.metrics.task_discarded(task.args[0], killed=True)
+                if self.long_running:
+                    self._release_record(task.args[0])
+                task.done.set()
+                continue
+            self._acquire_slot()
+            self._start_lease(task.args[5], task)
+            self._run_task(task)
+
+    def _new_handle(self, target, args):
+        if not self.persistent_workers:
+            return ThreadWithException(target=target, args=args)
+        return PooledTask(target, args)
+
+    def _start(self, thread):
+        if isinstance(thread, PooledTask):
+            self._run_task(thread)
+        else:
+            thread.start()
+
+    def _run_task(self, task):
+        if not self.persistent_workers:
+            ThreadWithException(target=task.run).start()
+            return
+        self._task_queue.put(task)
+        if len(self.workers) < self.max_thread:
+            worker = ThreadWithException(target=self._work, args=(self._task_queue, self.workers), daemon=True)
+            self.workers.append(worker)
+            worker.start()
+
+    @staticmethod
+    def _work(task_queue, workers):
+        while threading.current_thread() in workers:
+            try:
+                task = task_queue.get()
+                if task is None:
+                    return
+                task.run()
+            except SystemExit:
+                continue
+
+    def shutdown(self):
+        for _ in self.workers:
+            self._task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def map(self, func, iterable, chunksize=1, ordered=True, window=0, raise_exception=False, with_status=False):
+        window = window if window > 0 else 2 * self.max_thread
+        chunk_res_queue = Queue()
+        iterator = iter(iterable)
+        buffered_chunks = {}
+        submitted_chunks = 0
+        yielded_chunks = 0
+        exhausted = False
+        while True:
+            while not exhausted and submitted_chunks - yielded_chunks < window:
+                chunk = list(itertools.islice(iterator, chunksize))
+                if not chunk:
+                    exhausted = True
+                    break
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(count=len(chunk))
+                self.main_semaphore.acquire()
+                self.sub_semaphore.acquire()
+                self._start(self._new_handle(self._run_chunk, (submitted_chunks, func, chunk, chunk_res_queue)))
+                submitted_chunks += 1
+            if submitted_chunks == yielded_chunks:
+                return
+            chunk_number, results = chunk_res_queue.get()
+            if ordered:
+                buffered_chunks[chunk_number] = results
+                ready_chunks = []
+                while yielded_chunks + len(ready_chunks) in buffered_chunks:
+                    ready_chunks.append(buffered_chunks.pop(yielded_chunks + len(ready_chunks)))
+            else:
+                ready_chunks = [results]
+            for results in ready_chunks:
+                yielded_chunks += 1
+                for success, res in results:
+                    if not success and raise_exception:
+                        raise res
+                    yield (success, res) if with_status else res
+
+    _apply_chunk = staticmethod(apply_chunk)
+
+    def _run_chunk(self, chunk_number, func, chunk, chunk_res_queue):
+        results = []
+        try:
+            results = self._apply_chunk(func, chunk)
+        except Exception as e:
+            results = [(False, e)] * len(chunk)
+        finally:
+            self.main_semaphore.release()
+            self.sub_semaphore.release()
+            for success, res in results:
+                if success:
+                    continue
+                if self.log_exception:
+                    err_msg = ''.join(traceback.format_exception(type(res), res, res.__traceback__))
+                    logging.error(f"Chunk {chunk_number} failed when execute {func.__name__}, error msg: \n{err_msg}")
+                if self.exit_for_any_exception:
+                    os._exit(-1)
+            chunk_res_queue.put((chunk_number, results))
+
+    def _shared_semaphore(self, weight, min_threads, name):
+        if self.fair_share:
+            return self.main_semaphore.scheduler.tenant(weight, min_threads, name)
+        return self.main_semaphore
+
+    def new_shared_pool(self, exit_for_any_exception=False, max_thread=0, weight=1, min_threads=0, name=None):
+        return NativeThreadPool(semaphore=self._shared_semaphore(weight, min_threads, name), exit_for_any_exception=exit_for_any_exception,
+                                max_thread=max_thread if max_thread > 0 else self.max_thread,
+                                persistent_workers=self.persistent_workers,
+                                backlog_capacity=self.backlog.maxsize if self.backlog is not None else 0,
+                                overflow_policy=self.overflow_policy, long_running=self.long_running,
+                                metrics=self.metrics is not None, fair_share=self.fair_share,
+                                prioritized=self.prioritized, aging_seconds=self.aging_seconds,
+                                rate_limiter=self.rate_limiter,
+                                concurrency_controller=self.concurrency_controller, coalescer=self.coalescer)
+
+    def stats(self):
+        return self.metrics.snapshot() if self.metrics is not None else None
+
+    def concurrency_stats(self):
+        return self.concurrency_controller.stats() if self.concurrency_controller is not None else None
+
+    def dedup_stats(self):
+        return self.coalescer.stats() if self.coalescer is not None else None
+
+    def rate_limit_stats(self):
+        return self.rate_limiter.stats() if self.rate_limiter is not None else None
+
+    def share_stats(self):
+        return self.main_semaphore.scheduler.stats() if self.fair_share else None
 
     def get_results_order_by_index(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
         self.valid_for_new_thread = False
         threads_result = [''] * len(self.thread_list) if with_status else [('', '')] * len(self.thread_list)
-        logging.info(f"thread_list: {self.thread_list}")
-        logging.info(f"killed_threads: {self.killed_threads}")
-        for index in range(len(self.thread_list) - len(self.killed_threads)):
+        positions = {n: index for index, n in enumerate(sorted(self.thread_list))} if self.long_running else None
+        logging.info("thread_list: %s", self.thread_list)
+        logging.info("killed_threads: %s", self.killed_threads)
+        for index in range(self._pending_result_count()):
             thread_number, success, res = self._thread_res_queue.get()
 
-            logging.info(f"thread_number: {thread_number}")
-            logging.info(f"success: {success}")
-            logging.info(f"res: {res}")
+            logging.info("thread_number: %s", thread_number)
+            logging.info("success: %s", success)
+            logging.info("res: %s", res)
             if thread_number in self.killed_threads:
                 continue
+            if self.long_running:
+                self._release_record(thread_number)
+                thread_number = positions[thread_number]
 
             if success or not raise_exception:
                 threads_result[thread_number] = (success, res) if with_status else res
@@ -121,17 +628,22 @@ class NativeThreadPool:
         return threads_result
 
     def get_results_order_by_time(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
-        self.valid_for_new_thread = False
-        for index in range(len(self.thread_list) - len(self.killed_threads)):
+        if not self.long_running:
+            self.valid_for_new_thread = False
+        total = self._pending_result_count()
+        for index in range(total):
             thread_number, success, res = self._thread_res_queue.get()
+            if self.long_running:
+                self._release_record(thread_number)
             if success or not raise_exception:
-                if index == len(self.thread_list) - 1:
+                if index == total - 1 and not self.long_running:
                     self.refresh()
                 yield (success, res) if with_status else res
             else:
                 if stop_all_for_exception:
                     self.stop_all()
-                self.refresh()
+                if not self.long_running:
+                    self.refresh()
                 raise res
 
     def get_one_result(self, raise_exception=False, with_status=False, stop_all_for_exception=False):
@@ -139,7 +651,10 @@ class NativeThreadPool:
             thread_number, success, res = self._thread_res_queue.get()
             if thread_number in self.killed_threads:
                 continue
-            self.killed_threads.add(thread_number)
+            if self.long_running:
+                self._release_record(thread_number)
+            else:
+                self.killed_threads.add(thread_number)
             if not success and raise_exception:
                 if stop_all_for_exception:
                     self.stop_all()
@@ -147,31 +662,56 @@ class NativeThreadPool:
             return (success, res) if with_status else res
 
     def wait_all_threads(self, raise_exception=False):
-        for thread in self.thread_list:
+        for thread in list(self.thread_list.values()) if self.long_running else self.thread_list:
             thread.join()
-        for _ in range(len(self.thread_list) - len(self.killed_threads)):
+        for _ in range(self._pending_result_count()):
             thread_number, success, res = self._thread_res_queue.get()
+            if self.long_running:
+                self._release_record(thread_number)
             if not success and not raise_exception:
                 self.refresh()
                 raise res
         self.refresh()
 
     def stop_all(self):
-        for index in range(len(self.thread_list)):
+        for index in list(self.thread_list) if self.long_running else range(len(self.thread_list)):
             self.stop_nth_thread(index)
 
     def stop_nth_thread(self, n):
-        if n not in self.completed_threads:
+        if n in self.completed_threads or (self.long_running and n not in self.thread_list):
+            return
 
-            logging.info(f'stop_nth_thread {n}')
+        logging.info('stop_nth_thread %s', n)
 
-            self.completed_threads.add(n)
-            self.killed_threads.add(n)
-            self.thread_list[n].kill()
+        self.completed_threads.add(n)
+        self.killed_threads.add(n)
+        thread = self.thread_list[n]
+        if self.long_running:
+            self.thread_list.pop(n)
+        thread.kill()
 
     def refresh(self):
-        self.thread_list = []
         self.valid_for_new_thread = True
+        self.deadline = None
+        if self.long_running:
+            for thread_number in list(self.thread_list):
+                if thread_number in self.completed_threads:
+                    self._release_record(thread_number)
+                else:
+                    self.killed_threads.add(thread_number)
+                    self.thread_list.pop(thread_number)
+            self._thread_res_queue = Queue()
+            return
+        while self.backlog is not None and not self.backlog.empty():
+            try:
+                task = self.backlog.get_nowait()
+            except Empty:
+                break
+            if self.metrics is not None:
+                self.metrics.task_discarded(task.args[0], killed=True)
+            task.done.set()
+        self.thread_list = []
+        self.task_counter = 0
         self.completed_threads = set()
         self.killed_threads = set()
         self._thread_res_queue = Queue()
@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+class AimdController:
+
+    __slots__ = ('scheduler', 'min_limit', 'max_limit', 'limit', 'window', 'backoff', 'latency_tolerance',
+                 'max_error_rate', 'baseline_drift', 'baseline', 'lock', 'samples', 'errors', 'latency_sum', 'peak',
+                 'window_started_at', 'latency', 'error_rate', 'throughput', 'increases', 'decreases')
+
+    def __init__(self, scheduler, min_limit, max_limit, initial_limit=0, window=0, backoff=0.9,
+                 latency_tolerance=1.5, max_error_rate=0.1, baseline_drift=0.05):
+        assert 0 < min_limit <= max_limit and 0 < backoff < 1 and latency_tolerance > 1
+        self.scheduler = scheduler
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max_limit, max(min_limit, initial_limit))
+        self.window = window
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.baseline_drift = baseline_drift
+        self.baseline = None
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.peak = 0
+        self.window_started_at = time.perf_counter()
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.throughput = 0.0
+        self.increases = 0
+        self.decreases = 0
+        scheduler.resize(self.limit)
+
+    def observe(self, latency, success):
+        with self.lock:
+            self.samples += 1
+            self.errors += not success
+            self.latency_sum += latency
+            self.peak = max(self.peak, self.scheduler.in_use)
+            if self.samples < (self.window or self.limit):
+                return
+            now = time.perf_counter()
+            self.latency = self.latency_sum / self.samples
+            self.error_rate = self.errors / self.samples
+            self.throughput = self.samples / (now - self.window_started_at) if now > self.window_started_at else 0.0
+            limit = self.limit
+            if self.baseline is None or self.latency < self.baseline:
+                self.baseline = self.latency
+            elif limit == self.min_limit:
+                self.baseline += (self.latency - self.baseline) * self.baseline_drift
+            if self.error_rate > self.max_error_rate or self.latency > self.baseline * self.latency_tolerance:
+                limit = max(self.min_limit, min(limit - 1, int(limit * self.backoff)))
+            elif self.peak >= limit:
+                limit = min(self.max_limit, limit + 1)
+            if limit != self.limit:
+                if limit > self.limit:
+                    self.increases += 1
+                else:
+                    self.decreases += 1
+                self.limit = limit
+                self.scheduler.resize(limit)
+            self.samples = 0
+            self.errors = 0
+            self.latency_sum = 0.0
+            self.peak = 0
+            self.window_started_at = now
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'in_use': self.scheduler.in_use,
+                'latency': self.latency,
+                'baseline': self.baseline,
+                'error_rate': self.error_rate,
+                'throughput': self.throughput,
+                'increases': self.increases,
+                'decreases': self.decreases,
+            }
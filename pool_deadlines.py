@@ -0,0 +1,94 @@
+from heapq import heapify, heappop, heappush
+import itertools
+import logging
+import threading
+import time
+import traceback
+
+
+class TaskLease:
+
+    __slots__ = ('thread_number', 'timeout', 'started_at', 'expires_at', 'handle', 'result_queue', 'finished', 'lock')
+
+    def __init__(self, thread_number, timeout, result_queue):
+        assert timeout is None or timeout >= 0
+        self.thread_number = thread_number
+        self.timeout = timeout
+        self.started_at = None
+        self.expires_at = None
+        self.handle = None
+        self.result_queue = result_queue
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def settle(self):
+        with self.lock:
+            if self.finished:
+                return False
+            self.finished = True
+            return True
+
+
+class DeadlineTimer:
+
+    __slots__ = ('on_expire', 'spawn', 'event_factory', 'lock', 'heap', 'wakeup', 'running', 'settled', 'sequence')
+
+    def __init__(self, on_expire, spawn, event_factory=threading.Event):
+        self.on_expire = on_expire
+        self.spawn = spawn
+        self.event_factory = event_factory
+        self.lock = threading.Lock()
+        self.heap = []
+        self.wakeup = None
+        self.running = False
+        self.settled = 0
+        self.sequence = itertools.count()
+
+    def schedule(self, lease, deadline=None):
+        now = time.perf_counter()
+        expires_at = now + lease.timeout if lease.timeout is not None else deadline
+        if deadline is not None and deadline < expires_at:
+            expires_at = deadline
+        lease.started_at = now
+        lease.expires_at = expires_at
+        with self.lock:
+            heappush(self.heap, (expires_at, next(self.sequence), lease))
+            if self.running:
+                if self.heap[0][2] is lease:
+                    self.wakeup.set()
+                return
+            self.running = True
+            self.wakeup = self.event_factory()
+        self.spawn(self._run)
+
+    def discard(self):
+        with self.lock:
+            self.settled += 1
+            if self.settled * 2 > len(self.heap) > 64:
+                self.heap = [entry for entry in self.heap if not entry[2].finished]
+                heapify(self.heap)
+                self.settled = 0
+
+    def _run(self):
+        while True:
+            expired = []
+            with self.lock:
+                now = time.perf_counter()
+                heap = self.heap
+                while heap and heap[0][0] <= now:
+                    expired.append(heappop(heap)[2])
+                if not heap and not expired:
+                    self.running = False
+                    return
+                timeout = heap[0][0] - now if heap else 0
+                wakeup = self.wakeup
+                wakeup.clear()
+            for lease in expired:
+                if lease.finished:
+                    continue
+                try:
+                    self.on_expire(lease)
+                except Exception:
+                    logging.error(f"Failed to expire thread {lease.thread_number}, error msg: \n{traceback.format_exc()}")
+            if timeout > 0:
+                wakeup.wait(timeout)
@@ -0,0 +1,98 @@
+import functools
+import threading
+
+from pool_exceptions import TaskDroppedError, TaskTimeoutError
+
+
+class InFlightCall:
+
+    __slots__ = ('key', 'event', 'outcome', 'followers', 'callbacks', 'lock')
+
+    def __init__(self, key, event):
+        self.key = key
+        self.event = event
+        self.outcome = None
+        self.followers = 0
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def resolve(self, success, res):
+        with self.lock:
+            if self.outcome is not None:
+                return
+            self.outcome = (success, res)
+            callbacks, self.callbacks = self.callbacks, []
+        self.event.set()
+        for callback in callbacks:
+            callback(success, res)
+
+    def add_callback(self, callback):
+        with self.lock:
+            if self.outcome is None:
+                self.callbacks.append(callback)
+                return
+        callback(*self.outcome)
+
+    def follower(self, func, timeout=None):
+
+        @functools.wraps(func)
+        def wait_for_leader(*args, **kwargs):
+            if not self.event.wait(timeout):
+                raise TaskTimeoutError(f'Timed out waiting for in-flight call {self.key!r}')
+            success, res = self.outcome
+            if not success:
+                raise res
+            return res
+
+        return wait_for_leader
+
+
+class CallCoalescer:
+
+    __slots__ = ('key_func', 'event_factory', 'lock', 'calls', 'executed', 'coalesced')
+
+    def __init__(self, key_func, event_factory):
+        self.key_func = key_func
+        self.event_factory = event_factory
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def join(self, func, args, kwargs):
+        key = self.key_func(*args, **kwargs)
+        if key is None:
+            return None, True
+        key = (func, key)
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.coalesced += 1
+                return call, False
+            call = self.calls[key] = InFlightCall(key, self.event_factory())
+            self.executed += 1
+            return call, True
+
+    def finish(self, call, success, res):
+        with self.lock:
+            if self.calls.get(call.key) is call:
+                del self.calls[call.key]
+        call.resolve(success, res)
+
+    def drop(self, call):
+        self.finish(call, False, TaskDroppedError(f'In-flight call {call.key!r} was stopped before finishing'))
+
+    def withdraw(self, call):
+        with self.lock:
+            self.executed -= 1
+        self.drop(call)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.calls),
+                'followers': sum(call.followers for call in self.calls.values()),
+            }
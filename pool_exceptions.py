@@ -0,0 +1,10 @@
+class PoolFullError(Exception):
+    pass
+
+
+class TaskDroppedError(Exception):
+    pass
+
+
+class TaskTimeoutError(Exception):
+    pass
@@ -0,0 +1,143 @@
+import fcntl
+import itertools
+import os
+import threading
+import time
+
+_lock_files = {}
+_lock_files_lock = threading.Lock()
+
+
+class _LockFile:
+
+    __slots__ = ('key', 'fd', 'lock', 'held', 'users')
+
+    def __init__(self, key):
+        self.key = key
+        self.fd = os.open(key[0], os.O_RDWR | os.O_CREAT, 0o666)
+        self.lock = threading.Lock()
+        self.held = set()
+        self.users = 0
+
+    def try_lock(self, slot):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+            return True
+        except OSError:
+            return False
+
+    def unlock(self, slot):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, slot)
+
+
+def _open_lock_file(path):
+    key = (os.path.realpath(path), os.getpid())
+    with _lock_files_lock:
+        lock_file = _lock_files.get(key)
+        if lock_file is None:
+            lock_file = _lock_files[key] = _LockFile(key)
+        lock_file.users += 1
+        return lock_file
+
+
+def _close_lock_file(lock_file):
+    with _lock_files_lock:
+        lock_file.users -= 1
+        with lock_file.lock:
+            if lock_file.users > 0 or lock_file.held:
+                return
+            os.close(lock_file.fd)
+            lock_file.fd = None
+        _lock_files.pop(lock_file.key, None)
+
+
+class HostSemaphore:
+
+    __slots__ = ('path', 'value', 'sleep', 'poll_interval', 'lock_file', 'pid', 'held', 'cursor')
+
+    def __init__(self, path, value, sleep=time.sleep, poll_interval=0.01):
+        assert value > 0
+        self.path = path
+        self.value = value
+        self.sleep = sleep
+        self.poll_interval = poll_interval
+        self.lock_file = _open_lock_file(path)
+        self.pid = os.getpid()
+        self.held = set()
+        self.cursor = itertools.count(os.getpid())
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.held = set()
+            self.cursor = itertools.count(self.pid)
+            self.lock_file = _open_lock_file(self.path)
+        return self.lock_file
+
+    def _try_acquire(self):
+        lock_file = self._check_fork()
+        with lock_file.lock:
+            start = next(self.cursor)
+            for offset in range(self.value):
+                slot = (start + offset) % self.value
+                if slot not in lock_file.held and lock_file.try_lock(slot):
+                    lock_file.held.add(slot)
+                    self.held.add(slot)
+                    return True
+            return False
+
+    def acquire(self, blocking=True, timeout=None):
+        expire_at = time.perf_counter() + timeout if timeout is not None else None
+        interval = 0.001
+        while not self._try_acquire():
+            if not blocking:
+                return False
+            if expire_at is not None:
+                remaining = expire_at - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                interval = min(interval, remaining)
+            self.sleep(interval)
+            interval = min(interval * 2, self.poll_interval)
+        return True
+
+    def release(self):
+        lock_file = self._check_fork()
+        with lock_file.lock:
+            if not self.held:
+                raise ValueError('Semaphore released too many times')
+            slot = self.held.pop()
+            lock_file.held.discard(slot)
+            lock_file.unlock(slot)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        lock_file = self._check_fork()
+        with lock_file.lock:
+            in_use = 0
+            for slot in range(self.value):
+                if slot in lock_file.held:
+                    in_use += 1
+                elif lock_file.try_lock(slot):
+                    lock_file.unlock(slot)
+                else:
+                    in_use += 1
+            return {'path': self.path, 'value': self.value, 'held': len(self.held), 'in_use': in_use}
+
+    def close(self):
+        if self.lock_file is None:
+            return
+        lock_file = self._check_fork()
+        with lock_file.lock:
+            for slot in self.held:
+                lock_file.held.discard(slot)
+                lock_file.unlock(slot)
+            self.held = set()
+        self.lock_file = None
+        _close_lock_file(lock_file)
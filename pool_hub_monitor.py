@@ -0,0 +1,87 @@
+import logging
+import time
+import weakref
+
+import greenlet
+from gevent.hub import Hub
+
+
+class HubBlockingDetector:
+
+    __slots__ = ('threshold', 'thresholds', 'labels', 'stalls', 'switched_at', 'previous_trace', 'active')
+
+    def __init__(self, threshold=0.1):
+        self.threshold = threshold
+        self.thresholds = {}
+        self.labels = weakref.WeakKeyDictionary()
+        self.stalls = {}
+        self.switched_at = time.perf_counter()
+        self.previous_trace = None
+        self.active = False
+
+    def start(self):
+        if self.active:
+            return
+        self.switched_at = time.perf_counter()
+        self.previous_trace = greenlet.settrace(self._trace)
+        self.active = True
+
+    def stop(self):
+        if not self.active:
+            return
+        greenlet.settrace(self.previous_trace)
+        self.previous_trace = None
+        self.active = False
+
+    def register(self, threshold):
+        self.thresholds[threshold] = self.thresholds.get(threshold, 0) + 1
+        self.threshold = min(self.thresholds)
+        self.start()
+
+    def unregister(self, threshold):
+        count = self.thresholds.pop(threshold, 0) - 1
+        if count > 0:
+            self.thresholds[threshold] = count
+        if self.thresholds:
+            self.threshold = min(self.thresholds)
+        else:
+            self.stop()
+
+    def label(self, glet, func, threshold=None):
+        self.labels[glet] = (getattr(func, '__qualname__', None) or repr(func), threshold)
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            now = time.perf_counter()
+            elapsed = now - self.switched_at
+            self.switched_at = now
+            origin = args[0]
+            if elapsed >= self.threshold and not isinstance(origin, Hub):
+                self._record(origin, elapsed)
+        if self.previous_trace is not None:
+            self.previous_trace(event, args)
+
+    def _record(self, origin, elapsed):
+        name, threshold = self.labels.get(origin, (None, None))
+        if threshold is not None and elapsed < threshold:
+            return
+        if name is None:
+            run = getattr(origin, '_run', None)
+            name = getattr(run, '__qualname__', None) or ('main' if origin.parent is None else type(origin).__name__)
+        stall = self.stalls.get(name)
+        if stall is None:
+            stall = self.stalls[name] = [0, 0.0, 0.0]
+        stall[0] += 1
+        stall[1] += elapsed
+        stall[2] = max(stall[2], elapsed)
+        logging.warning(f'{name} blocked the gevent hub for {elapsed:.3f}s')
+
+    def report(self):
+        return [{'function': name, 'count': count, 'total': total, 'max': longest}
+                for name, (count, total, longest) in sorted(self.stalls.items(), key=lambda item: -item[1][1])]
+
+    def reset(self):
+        self.stalls = {}
+
+
+hub_blocking_detector = HubBlockingDetector()
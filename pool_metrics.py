@@ -0,0 +1,118 @@
+from bisect import bisect_left
+import threading
+import time
+
+
+DEFAULT_BUCKETS = tuple(0.0001 * 2 ** index for index in range(21))
+
+
+class Histogram:
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': [(bound, bucket_count) for bound, bucket_count in zip(self.bounds + (float('inf'),), self.counts) if bucket_count],
+        }
+
+
+class PoolMetrics:
+
+    __slots__ = ('max_thread', 'lock', 'created_at', 'submit_times', 'queue_wait', 'run_time',
+                 'submitted', 'succeeded', 'failed', 'killed', 'dropped', 'in_flight', 'busy_time')
+
+    def __init__(self, max_thread):
+        self.max_thread = max_thread
+        self.lock = threading.Lock()
+        self.created_at = time.perf_counter()
+        self.submit_times = {}
+        self.queue_wait = Histogram()
+        self.run_time = Histogram()
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.killed = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self.busy_time = 0.0
+
+    def task_submitted(self, thread_number, submitted_at=None):
+        with self.lock:
+            self.submitted += 1
+            self.submit_times[thread_number] = submitted_at if submitted_at is not None else time.perf_counter()
+
+    def task_started(self, thread_number):
+        started_at = time.perf_counter()
+        with self.lock:
+            submitted_at = self.submit_times.pop(thread_number, started_at)
+            self.queue_wait.observe(started_at - submitted_at)
+            self.in_flight += 1
+        return started_at
+
+    def task_finished(self, started_at, success, killed):
+        elapsed = time.perf_counter() - started_at
+        with self.lock:
+            self.run_time.observe(elapsed)
+            self.busy_time += elapsed
+            self.in_flight -= 1
+            if killed:
+                self.killed += 1
+            elif success:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def task_discarded(self, thread_number, killed):
+        with self.lock:
+            self.submit_times.pop(thread_number, None)
+            if killed:
+                self.killed += 1
+            else:
+                self.dropped += 1
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.perf_counter() - self.created_at
+            return {
+                'submitted': self.submitted,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'killed': self.killed,
+                'dropped': self.dropped,
+                'in_flight': self.in_flight,
+                'max_thread': self.max_thread,
+                'utilization': self.busy_time / (uptime * self.max_thread) if uptime > 0 and self.max_thread > 0 else 0.0,
+                'queue_wait': self.queue_wait.snapshot(),
+                'run_time': self.run_time.snapshot(),
+            }
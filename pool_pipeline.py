@@ -0,0 +1,181 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+
+import gevent
+from gevent import get_hub
+
+from gevent_thread_pool import GeventThreadPool
+
+_END = object()
+_EMPTY = object()
+_POLL_INTERVAL = 0.05
+
+
+def _get_or_empty(q, timeout):
+    try:
+        return q.get(timeout=timeout)
+    except queue.Empty:
+        return _EMPTY
+
+
+def _put_or_full(q, item, timeout):
+    try:
+        q.put(item, timeout=timeout)
+        return True
+    except queue.Full:
+        return False
+
+
+def _batched(iterator, batch_size):
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class _Stage:
+
+    __slots__ = ('name', 'func', 'pool', 'batch_size', 'ordered', 'window', 'queue', 'cooperative', 'processed',
+                 'failed', 'started_at', 'finished_at')
+
+    def __init__(self, name, func, pool, batch_size, queue_size, ordered, window):
+        self.name = name
+        self.func = func
+        self.pool = pool
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.window = window
+        self.queue = queue.Queue(queue_size)
+        self.cooperative = isinstance(pool, GeventThreadPool)
+        self.processed = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def stats(self):
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            'name': self.name,
+            'processed': self.processed,
+            'failed': self.failed,
+            'queued': self.queue.qsize(),
+            'elapsed': elapsed,
+            'throughput': self.processed / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class Pipeline:
+
+    __slots__ = ('source', 'stages', 'error', 'cancelled', 'started')
+
+    def __init__(self, source):
+        self.source = source
+        self.stages = []
+        self.error = None
+        self.cancelled = False
+        self.started = False
+
+    def stage(self, func, pool, batch_size=1, queue_size=0, ordered=True, window=0, name=None):
+        assert not self.started and batch_size > 0
+        queue_size = queue_size if queue_size > 0 else 2 * pool.max_thread
+        name = name or getattr(func, '__name__', None) or f'stage-{len(self.stages)}'
+        self.stages.append(_Stage(name, func, pool, batch_size, queue_size, ordered, window))
+        return self
+
+    def _get(self, q, cooperative):
+        while not self.cancelled:
+            if cooperative:
+                try:
+                    return q.get_nowait()
+                except queue.Empty:
+                    item = get_hub().threadpool.apply(_get_or_empty, (q, _POLL_INTERVAL))
+            else:
+                item = _get_or_empty(q, _POLL_INTERVAL)
+            if item is not _EMPTY:
+                return item
+        return _END
+
+    def _put(self, q, item, cooperative):
+        while not self.cancelled:
+            if cooperative:
+                try:
+                    return q.put_nowait(item)
+                except queue.Full:
+                    if get_hub().threadpool.apply(_put_or_full, (q, item, _POLL_INTERVAL)):
+                        return
+            elif _put_or_full(q, item, _POLL_INTERVAL):
+                return
+
+    def _drain(self, q, cooperative):
+        while True:
+            item = self._get(q, cooperative)
+            if item is _END:
+                return
+            yield item
+
+    def _fail(self, error):
+        if self.error is None and not self.cancelled:
+            self.error = error
+        self.cancelled = True
+
+    def _pump(self, stage, upstream):
+        stage.started_at = time.perf_counter()
+        try:
+            items = upstream if stage.batch_size == 1 else _batched(iter(upstream), stage.batch_size)
+            for success, res in stage.pool.map(stage.func, items, ordered=stage.ordered, window=stage.window,
+                                               with_status=True):
+                if self.cancelled:
+                    break
+                if not success:
+                    stage.failed += 1
+                    logging.error(f'Pipeline stage {stage.name} failed, cancelling the pipeline')
+                    self._fail(res)
+                    break
+                stage.processed += 1
+                self._put(stage.queue, res, stage.cooperative)
+        except Exception as e:
+            logging.error(f'Pipeline stage {stage.name} failed to read its input: {e!r}')
+            self._fail(e)
+        finally:
+            stage.finished_at = time.perf_counter()
+            self._put(stage.queue, _END, stage.cooperative)
+
+    def run(self):
+        assert self.stages and not self.started
+        self.started = True
+        upstream = self.source
+        for index, stage in enumerate(self.stages):
+            if stage.cooperative:
+                gevent.spawn(self._pump, stage, upstream)
+            else:
+                threading.Thread(target=self._pump, args=(stage, upstream), daemon=True).start()
+            if index + 1 < len(self.stages):
+                upstream = self._drain(stage.queue, self.stages[index + 1].cooperative)
+        last = self.stages[-1]
+        cooperative = any(stage.cooperative for stage in self.stages)
+        try:
+            while True:
+                item = self._get(last.queue, cooperative)
+                if item is _END:
+                    break
+                yield item
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.cancel()
+
+    def __iter__(self):
+        return self.run()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages]
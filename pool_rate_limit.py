@@ -0,0 +1,53 @@
+import threading
+import time
+
+
+class TokenBucket:
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at', 'lock', 'sleep', 'waited', 'wait_time')
+
+    def __init__(self, rate, burst=0, sleep=time.sleep):
+        assert rate > 0 and burst >= 0
+        self.rate = rate
+        self.burst = burst if burst > 0 else max(1, rate)
+        self.tokens = self.burst
+        self.updated_at = time.perf_counter()
+        self.lock = threading.Lock()
+        self.sleep = sleep
+        self.waited = 0
+        self.wait_time = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, blocking=True, count=1):
+        with self.lock:
+            self._refill(time.perf_counter())
+            if self.tokens >= count:
+                self.tokens -= count
+                return True
+            if not blocking:
+                return False
+            self.tokens -= count
+            delay = -self.tokens / self.rate
+            self.waited += 1
+            self.wait_time += delay
+        self.sleep(delay)
+        return True
+
+    def release(self, count=1):
+        with self.lock:
+            self._refill(time.perf_counter())
+            self.tokens = min(self.burst, self.tokens + count)
+
+    def stats(self):
+        with self.lock:
+            self._refill(time.perf_counter())
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': self.tokens,
+                'waited': self.waited,
+                'wait_time': self.wait_time,
+            }
@@ -0,0 +1,160 @@
+from heapq import heapify, heappop, heappush
+import itertools
+import threading
+import time
+import weakref
+
+
+_priority_sequence = itertools.count()
+
+
+def priority_key(priority, aging_seconds):
+    return ((time.perf_counter() / aging_seconds if aging_seconds else 0.0) - priority, next(_priority_sequence))
+
+
+class _Waiter:
+
+    __slots__ = ('event', 'granted', 'key', 'enqueued_at')
+
+    def __init__(self, event, key):
+        self.event = event
+        self.granted = False
+        self.key = key
+        self.enqueued_at = time.perf_counter()
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class FairShare:
+
+    __slots__ = ('scheduler', 'name', 'weight', 'min_threads', 'in_use', 'waiters', 'granted', 'wait_time', '__weakref__')
+
+    def __init__(self, scheduler, weight, min_threads, name):
+        assert weight > 0 and min_threads >= 0
+        self.scheduler = scheduler
+        self.name = name
+        self.weight = weight
+        self.min_threads = min_threads
+        self.in_use = 0
+        self.waiters = []
+        self.granted = 0
+        self.wait_time = 0.0
+
+    def acquire(self, blocking=True, timeout=None, priority=0):
+        return self.scheduler.acquire(self, blocking, timeout, priority)
+
+    def release(self):
+        self.scheduler.release(self)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        with self.scheduler.lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            'name': self.name,
+            'weight': self.weight,
+            'min_threads': self.min_threads,
+            'in_use': self.in_use,
+            'waiting': len(self.waiters),
+            'granted': self.granted,
+            'wait_time': self.wait_time,
+        }
+
+
+class FairScheduler:
+
+    __slots__ = ('capacity', 'in_use', 'tenants', 'lock', 'event_factory', 'aging_seconds')
+
+    def __init__(self, capacity, event_factory=threading.Event, aging_seconds=0):
+        self.capacity = capacity
+        self.in_use = 0
+        self.tenants = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.event_factory = event_factory
+        self.aging_seconds = aging_seconds
+
+    def tenant(self, weight=1, min_threads=0, name=None):
+        with self.lock:
+            assert sum(t.min_threads for t in self.tenants) + min_threads <= self.capacity
+            share = FairShare(self, weight, min_threads, name if name is not None else f'pool-{len(self.tenants)}')
+            self.tenants.add(share)
+        return share
+
+    def acquire(self, tenant, blocking=True, timeout=None, priority=0):
+        waiter = _Waiter(self.event_factory(), priority_key(priority, self.aging_seconds))
+        with self.lock:
+            heappush(tenant.waiters, waiter)
+            self._dispatch()
+            if waiter.granted:
+                return True
+            if not blocking:
+                self._abandon(tenant, waiter)
+                return False
+        waiter.event.wait(timeout)
+        with self.lock:
+            if waiter.granted:
+                return True
+            self._abandon(tenant, waiter)
+            return False
+
+    @staticmethod
+    def _abandon(tenant, waiter):
+        tenant.waiters.remove(waiter)
+        heapify(tenant.waiters)
+
+    def resize(self, capacity):
+        assert capacity > 0
+        with self.lock:
+            self.capacity = capacity
+            self._dispatch()
+
+    def release(self, tenant):
+        with self.lock:
+            if tenant.in_use == 0:
+                raise ValueError('Semaphore released too many times')
+            tenant.in_use -= 1
+            self.in_use -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.in_use < self.capacity:
+            tenants = list(self.tenants)
+            reserved = sum(min(len(t.waiters), max(0, t.min_threads - t.in_use)) for t in tenants)
+            best = None
+            best_key = None
+            for t in tenants:
+                if not t.waiters:
+                    continue
+                below_min = t.in_use < t.min_threads
+                if not below_min and self.capacity - self.in_use <= reserved:
+                    continue
+                key = (not below_min, t.in_use / t.weight, t.waiters[0].key)
+                if best_key is None or key < best_key:
+                    best = t
+                    best_key = key
+            if best is None:
+                return
+            waiter = heappop(best.waiters)
+            waiter.granted = True
+            best.in_use += 1
+            best.granted += 1
+            best.wait_time += time.perf_counter() - waiter.enqueued_at
+            self.in_use += 1
+            waiter.event.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'capacity': self.capacity,
+                'in_use': self.in_use,
+                'tenants': sorted((t._snapshot() for t in self.tenants), key=lambda s: str(s['name'])),
+            }
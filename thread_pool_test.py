@@ -1,17 +1,50 @@
+import asyncio
 import datetime
+import fcntl
+import gc
+import io
+import multiprocessing
 import os, sys
+import pickle
+import signal
+import tempfile
+import threading
+import time
+import tracemalloc
 from unittest import mock
 
 import unittest2
 
 from gevent_thread_pool import GeventThreadPool as ThreadPool
+from native_thread_pool import NativeThreadPool
+from native_process_pool import NativeProcessPool
+from asyncio_task_pool import AsyncioTaskPool
+from logger import AsyncLogHandler, BufferedRotatingFileHandler, CustomLogger, Logger, iter_table_lines
+from misc import (DateRange, LocalVariableCache, LocalVariableStore, dump_local_variable, get_variable_from_local,
+                  iter_in_clauses, list_to_string, load_local_variable, local_cached, set_to_string)
+from pool_exceptions import PoolFullError, TaskDroppedError, TaskTimeoutError
+from pool_host_semaphore import HostSemaphore
+from pool_hub_monitor import hub_blocking_detector
+from pool_pipeline import Pipeline
+import gevent
 from gevent import sleep
+import greenlet
 from greenlet import GreenletExit as ExitException
 
 import logging
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
 
+_exit = os._exit
+
+
+def report_host_semaphore_in_use(path, checked):
+    checked.put(HostSemaphore(path, 2).stats()['in_use'])
+    checked.close()
+    checked.join_thread()
+    _exit(0)
+
+
 # from native_thread_pool import NativeThreadPool as ThreadPool
 # from time import sleep
 # ExitException = SystemExit
@@ -45,6 +78,50 @@ class ThreadPoolTest(unittest2.TestCase):
         self.assertEqual("1,(2, 3),{'a': 4, 'b': 5}", res[0])
         self.assertEqual("11,(22, 33),{'a': 44, 'b': 55}", res[1])
 
+    def test_native_thread_pool_should_reuse_persistent_workers(self):
+        pool = NativeThreadPool(total_thread_number=2, persistent_workers=True)
+        for index in range(10):
+            pool.apply_async(self.func_with_args_and_kwargs, args=(index,))
+        res = pool.get_results_order_by_index()
+        self.assertEqual([f"{index},(),{{}}" for index in range(10)], res)
+        self.assertEqual(2, len(pool.workers))
+        pool.shutdown()
+
+    def test_native_process_pool_should_get_results_and_raise_exception(self):
+        pool = NativeProcessPool(total_thread_number=2, log_exception=False)
+        pool.apply_async(self.func_with_args_and_kwargs, args=(1, 2), kwargs=dict(a=3))
+        pool.apply_async(bytearray, args=(2 * 1024 * 1024,))
+        res = pool.get_results_order_by_index()
+        self.assertEqual("1,(2,),{'a': 3}", res[0])
+        self.assertEqual(bytearray(2 * 1024 * 1024), res[1])
+        pool.apply_async(self.gevent_func_with_sleep_and_exception, kwargs=dict(sleep_second=0))
+        with self.assertRaisesRegex(RuntimeError, "^Not Killed$"):
+            pool.get_results_order_by_index(raise_exception=True)
+
+    def test_asyncio_task_pool_should_get_results_and_stop_nth_task(self):
+
+        async def async_func_with_sleep(param, sleep_second=0.1):
+            await asyncio.sleep(sleep_second)
+            return param
+
+        async def run():
+            pool = AsyncioTaskPool(total_thread_number=2)
+            await pool.apply_async(async_func_with_sleep, args=(1,), kwargs=dict(sleep_second=0.2))
+            await pool.apply_async(async_func_with_sleep, args=(2,), kwargs=dict(sleep_second=0.1))
+            by_time = [res async for res in pool.get_results_order_by_time()]
+            await pool.apply_async(async_func_with_sleep, args=(1,), kwargs=dict(sleep_second=1))
+            await pool.apply_async(async_func_with_sleep, args=(2,), kwargs=dict(sleep_second=0.1))
+            await pool.apply_async(async_func_with_sleep, args=(3,), kwargs=dict(sleep_second=0.1))
+            pool.stop_nth_thread(0)
+            by_index = await pool.get_results_order_by_index()
+            return by_time, by_index
+
+        start_time = datetime.datetime.now()
+        by_time, by_index = asyncio.run(run())
+        self.assertEqual([2, 1], by_time)
+        self.assertEqual([2, 3], by_index[1:])
+        self.assertLess((datetime.datetime.now() - start_time).total_seconds(), 0.6)
+
     def test_thread_pool_should_get_results_order_by_time(self):
         pool = ThreadPool(total_thread_number=2)
         pool.apply_async(self.gevent_func_with_sleep, args=(1,), kwargs=dict(sleep_second=0.2))
@@ -54,6 +131,69 @@ class ThreadPoolTest(unittest2.TestCase):
             self.assertLess(index, 2, f"Wrong index: {index}")
             self.assertEqual(expected_result_by_time[index], res)
 
+    def test_thread_pool_should_map_lazily_with_bounded_window(self):
+        pool = ThreadPool(total_thread_number=2)
+        consumed = []
+
+        def items():
+            for item in range(20):
+                consumed.append(item)
+                yield item
+
+        results = pool.map(self.gevent_func_with_sleep, items(), chunksize=2, window=2)
+        self.assertEqual(0, next(results))
+        self.assertLessEqual(len(consumed), 6)
+        self.assertEqual(list(range(1, 20)), list(results))
+        unordered = pool.map(self.gevent_func_with_sleep_and_exception, [0, 0.1], ordered=False, with_status=True)
+        self.assertEqual([False, False], [success for success, res in unordered])
+
+    def test_thread_pool_should_keep_memory_flat_when_long_running(self):
+        pool = ThreadPool(total_thread_number=4, long_running=True)
+        tracemalloc.start()
+        memory_after_round = []
+        for _ in range(3):
+            for index in range(5000):
+                pool.apply_async(self.func_with_args_and_kwargs, args=(index,))
+                if index >= 4:
+                    pool.get_one_result()
+            for _ in pool.get_results_order_by_time():
+                pass
+            memory_after_round.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        self.assertEqual(15000, pool.task_counter)
+        self.assertEqual((0, 0, 0), (len(pool.thread_list), len(pool.completed_threads), len(pool.killed_threads)))
+        self.assertLess(memory_after_round[-1] - memory_after_round[0], 64 * 1024)
+
+    def test_thread_pool_should_keep_results_of_concurrent_producer_when_long_running(self):
+        pool = ThreadPool(total_thread_number=4, long_running=True)
+        for index in range(8):
+            pool.apply_async(self.gevent_func_with_sleep, args=(index,), kwargs=dict(sleep_second=0.01))
+
+        def produce():
+            for index in range(8, 40):
+                pool.apply_async(self.gevent_func_with_sleep, args=(index,), kwargs=dict(sleep_second=0.01))
+
+        producer = gevent.spawn(produce)
+        results = list(pool.get_results_order_by_time())
+        producer.join()
+        while len(results) < 40:
+            results.extend(pool.get_results_order_by_time())
+        self.assertEqual(list(range(40)), sorted(results))
+        self.assertEqual((0, 0, 0), (len(pool.thread_list), len(pool.completed_threads), len(pool.killed_threads)))
+
+    def test_thread_pool_should_report_stats_when_metrics_enabled(self):
+        pool = ThreadPool(total_thread_number=2, metrics=True, log_exception=False)
+        pool.apply_async(self.gevent_func_with_sleep, args=(1,), kwargs=dict(sleep_second=0.1))
+        pool.apply_async(self.gevent_func_with_sleep_and_exception, kwargs=dict(sleep_second=0.1))
+        pool.apply_async(self.gevent_func_with_sleep, args=(3,), kwargs=dict(sleep_second=0.1))
+        pool.get_results_order_by_index()
+        stats = pool.stats()
+        self.assertEqual((3, 2, 1, 0), (stats['submitted'], stats['succeeded'], stats['failed'], stats['in_flight']))
+        self.assertEqual(3, stats['run_time']['count'])
+        self.assertAlmostEqual(0.1, stats['run_time']['p50'], 1)
+        self.assertAlmostEqual(0.1, stats['queue_wait']['max'], 1)
+        self.assertIsNone(ThreadPool(total_thread_number=1).stats())
+
     def test_thread_pool_should_block_new_async_job_when_pool_full(self):
         pool = ThreadPool(total_thread_number=1)
         start_time = datetime.datetime.now()
@@ -65,6 +205,39 @@ class ThreadPoolTest(unittest2.TestCase):
         self.assertAlmostEqual((time_of_job1_finish - start_time).microseconds / 1000000, 0.1, 1)
         self.assertAlmostEqual((time_of_job2_finish - start_time).microseconds / 1000000, 0.2, 1)
 
+    def test_thread_pool_should_apply_overflow_policy_when_backlog_full(self):
+        pool = ThreadPool(total_thread_number=1, backlog_capacity=2, overflow_policy='raise')
+        start_time = datetime.datetime.now()
+        pool.apply_async(self.gevent_func_with_sleep, args=(1,), kwargs=dict(sleep_second=0.1))
+        pool.apply_async(self.gevent_func_with_sleep, args=(2,), kwargs=dict(sleep_second=0.1))
+        with self.assertRaises(PoolFullError):
+            pool.apply_async(self.gevent_func_with_sleep, args=(3,), kwargs=dict(sleep_second=0.1))
+        self.assertIsNone(pool.try_apply_async(self.gevent_func_with_sleep, args=(3,), kwargs=dict(sleep_second=0.1)))
+        self.assertLess((datetime.datetime.now() - start_time).total_seconds(), 0.05)
+        self.assertEqual([1, 2], pool.get_results_order_by_index())
+
+        pool = ThreadPool(total_thread_number=1, backlog_capacity=1, overflow_policy='drop_oldest')
+        pool.apply_async(self.gevent_func_with_sleep, args=(1,), kwargs=dict(sleep_second=0.1))
+        pool.apply_async(self.gevent_func_with_sleep, args=(2,), kwargs=dict(sleep_second=0.1))
+        res = pool.get_results_order_by_index()
+        self.assertTrue(type(res[0]) == TaskDroppedError)
+        self.assertEqual(2, res[1])
+
+    def test_native_thread_pool_should_not_block_try_apply_behind_blocked_submitter(self):
+        pool = NativeThreadPool(total_thread_number=1, backlog_capacity=1)
+        for _ in range(3):
+            pool.apply_async(time.sleep, args=(0.3,))
+            time.sleep(0.02)
+        submitter = threading.Thread(target=pool.apply_async, args=(time.sleep, (0.01,)))
+        submitter.start()
+        time.sleep(0.05)
+        start_time = time.perf_counter()
+        self.assertIsNone(pool.try_apply_async(time.sleep, args=(0.01,)))
+        self.assertLess(time.perf_counter() - start_time, 0.05)
+        self.assertTrue(submitter.is_alive())
+        submitter.join()
+        self.assertEqual([None] * 4, pool.get_results_order_by_index())
+
     def test_thread_pool_should_share_pool_with_same_capacity(self):
         pool = ThreadPool(total_thread_number=1)
         start_time = datetime.datetime.now()
@@ -110,6 +283,560 @@ class ThreadPoolTest(unittest2.TestCase):
         self.assertAlmostEqual((job2_inserted_time - start_time).microseconds / 1000000, 0.3, 1)
         self.assertAlmostEqual((job_finished_time - start_time).microseconds / 1000000, 0.4, 1)
 
+    def test_thread_pool_should_share_capacity_by_weight_when_fair_share(self):
+        pool = ThreadPool(total_thread_number=4, fair_share=True)
+        pool_1 = pool.new_shared_pool(weight=3, name='heavy')
+        pool_2 = pool.new_shared_pool(weight=1, name='light')
+
+        submitters = [gevent.spawn(shared_pool.apply_async, self.gevent_func_with_sleep, args=(index,), kwargs=dict(sleep_second=0.05))
+                      for index in range(20) for shared_pool in (pool_1, pool_2)]
+        sleep(0.2)
+        in_use = {tenant['name']: tenant['in_use'] for tenant in pool.share_stats()['tenants']}
+        gevent.joinall(submitters)
+        self.assertEqual(list(range(20)), sorted(pool_1.get_results_order_by_index()))
+        self.assertEqual(list(range(20)), sorted(pool_2.get_results_order_by_index()))
+        self.assertEqual({'root': 0, 'heavy': 3, 'light': 1}, in_use)
+        self.assertEqual(0, pool.share_stats()['in_use'])
+        self.assertIsNone(ThreadPool(total_thread_number=1).share_stats())
+
+    def test_thread_pool_should_lend_reserved_threads_of_idle_tenant_when_fair_share(self):
+        pool = ThreadPool(total_thread_number=4, fair_share=True)
+        reserved_pool = pool.new_shared_pool(min_threads=3, name='reserved')
+        busy_pool = pool.new_shared_pool(name='busy')
+        for index in range(4):
+            self.assertIsNotNone(busy_pool.try_apply_async(self.gevent_func_with_sleep, args=(index,), kwargs=dict(sleep_second=0.1)))
+        started = []
+
+        def record(name):
+            started.append(name)
+            return name
+
+        submitters = [gevent.spawn(busy_pool.apply_async, record, args=('busy',))]
+        sleep(0.01)
+        submitters.append(gevent.spawn(reserved_pool.apply_async, record, args=('reserved',)))
+        gevent.joinall(submitters)
+        self.assertEqual([0, 1, 2, 3, 'busy'], busy_pool.get_results_order_by_index())
+        self.assertEqual(['reserved'], reserved_pool.get_results_order_by_index())
+        self.assertEqual(['reserved', 'busy'], started)
+
+    def test_thread_pool_should_run_higher_priority_first_when_prioritized(self):
+        pool = ThreadPool(total_thread_number=1, prioritized=True, backlog_capacity=10)
+        started = []
+
+        def record(name):
+            started.append(name)
+            sleep(0.01)
+            return name
+
+        for name, priority in (('a', 0), ('b', 0), ('c', 5), ('d', 1)):
+            pool.apply_async(record, args=(name,), priority=priority)
+        self.assertEqual(['a', 'b', 'c', 'd'], pool.get_results_order_by_index())
+        self.assertEqual(['c', 'd', 'a', 'b'], started)
+
+    def test_thread_pool_should_report_timeout_and_release_slot_when_task_overdue(self):
+        pool = ThreadPool(total_thread_number=1)
+        start_time = datetime.datetime.now()
+        pool.apply_async(self.gevent_func_with_sleep, args=(1,), kwargs=dict(sleep_second=5), timeout=0.1)
+        pool.apply_async(self.gevent_func_with_sleep, args=(2,), kwargs=dict(sleep_second=0.01))
+        pool.set_deadline(0.3)
+        pool.apply_async(self.gevent_func_with_sleep, args=(3,), kwargs=dict(sleep_second=5))
+        res = pool.get_results_order_by_index(with_status=True)
+        self.assertLess((datetime.datetime.now() - start_time).total_seconds(), 1)
+        self.assertEqual((True, 2), res[1])
+        self.assertFalse(res[0][0])
+        self.assertIsInstance(res[0][1], TaskTimeoutError)
+        self.assertFalse(res[2][0])
+        self.assertIsInstance(res[2][1], TaskTimeoutError)
+        self.assertIsNone(pool.deadline)
+
+    def test_thread_pool_should_wait_for_token_without_slot_when_rate_limited(self):
+        pool = ThreadPool(total_thread_number=2, rate_limit=20, burst=2)
+        shared_pool = pool.new_shared_pool()
+        start_time = datetime.datetime.now()
+        submitter = gevent.spawn(lambda: [shared_pool.apply_async(self.func_with_args_and_kwargs, args=(index,)) for index in range(6)])
+        sleep(0.05)
+        self.assertEqual(2, pool.main_semaphore.counter)
+        submitter.join()
+        self.assertEqual(6, len(shared_pool.get_results_order_by_index()))
+        self.assertGreater((datetime.datetime.now() - start_time).total_seconds(), 0.15)
+        self.assertIsNone(pool.try_apply_async(self.func_with_args_and_kwargs, args=(6,)))
+        self.assertIs(pool.rate_limiter, shared_pool.rate_limiter)
+
+    def test_thread_pool_should_limit_across_processes_and_reclaim_slots_when_host_semaphore(self):
+        path = os.path.join(tempfile.mkdtemp(), 'pool.lock')
+        semaphore = HostSemaphore(path, 2, sleep)
+        context = multiprocessing.get_context('fork')
+        ready = context.Event()
+
+        def hold_forever():
+            child_semaphore = HostSemaphore(path, 2)
+            child_semaphore.acquire()
+            ready.set()
+            signal.pause()
+
+        process = context.Process(target=hold_forever)
+        process.start()
+        ready.wait()
+        pool = ThreadPool(semaphore=semaphore, max_thread=2)
+        pool.apply_async(self.gevent_func_with_sleep, args=(1,))
+        self.assertIsNone(pool.try_apply_async(self.gevent_func_with_sleep, args=(2,)))
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+        pool.apply_async(self.gevent_func_with_sleep, args=(2,))
+        self.assertEqual(2, semaphore.stats()['in_use'])
+        self.assertEqual([1, 2], pool.get_results_order_by_index())
+        self.assertEqual(0, semaphore.stats()['in_use'])
+
+        other_semaphore = HostSemaphore(path, 2, sleep)
+        self.assertTrue(semaphore.acquire(blocking=False))
+        self.assertTrue(other_semaphore.acquire(blocking=False))
+        self.assertFalse(other_semaphore.acquire(blocking=False))
+        HostSemaphore(path, 2).close()
+        other_semaphore.close()
+        checked = context.Queue()
+        process = context.Process(target=report_host_semaphore_in_use, args=(path, checked))
+        process.start()
+        self.assertEqual(1, checked.get(timeout=5))
+        process.join()
+        semaphore.release()
+        semaphore.close()
+        semaphore.close()
+
+    def test_thread_pool_should_offload_blocking_task_and_report_hub_stall(self):
+        pool = ThreadPool(total_thread_number=3, blocking_threads=1, blocking_threshold=0.05)
+        ticks = []
+
+        def tick():
+            for _ in range(10):
+                sleep(0.01)
+                ticks.append(len(ticks))
+
+        def block_hub(seconds):
+            time.sleep(seconds)
+            return seconds
+
+        try:
+            pool.apply_async(tick)
+            pool.apply_async(block_hub, args=(0.2,), blocking=True)
+            sleep(0.15)
+            self.assertGreater(len(ticks), 5)
+            self.assertEqual([None, 0.2], pool.get_results_order_by_index())
+            self.assertEqual([], [stall for stall in pool.blocking_stats() if stall['function'].endswith('block_hub')])
+            pool.apply_async(block_hub, args=(0.1,))
+            pool.get_results_order_by_index()
+            stall = [stall for stall in pool.blocking_stats() if stall['function'].endswith('block_hub')][0]
+            self.assertEqual(1, stall['count'])
+            self.assertGreaterEqual(stall['max'], 0.1)
+        finally:
+            hub_blocking_detector.stop()
+            hub_blocking_detector.reset()
+
+    def test_thread_pool_should_keep_hub_stall_threshold_per_pool(self):
+        gc.collect()
+        self.assertEqual({}, hub_blocking_detector.thresholds)
+
+        def strict_block():
+            time.sleep(0.1)
+
+        def lax_block():
+            time.sleep(0.1)
+
+        strict_pool = ThreadPool(total_thread_number=1, blocking_threshold=0.05)
+        lax_pool = ThreadPool(total_thread_number=1, blocking_threshold=1.0)
+        try:
+            self.assertTrue(hub_blocking_detector.active)
+            self.assertEqual(0.05, hub_blocking_detector.threshold)
+            lax_pool.apply_async(lax_block)
+            lax_pool.get_results_order_by_index()
+            strict_pool.apply_async(strict_block)
+            strict_pool.get_results_order_by_index()
+            self.assertEqual(['strict_block'], [stall['function'].split('.')[-1] for stall in hub_blocking_detector.report()
+                                                if stall['function'].endswith('_block')])
+            del strict_pool
+            gc.collect()
+            self.assertEqual(1.0, hub_blocking_detector.threshold)
+            del lax_pool
+            gc.collect()
+            self.assertFalse(hub_blocking_detector.active)
+            self.assertIsNone(greenlet.gettrace())
+        finally:
+            hub_blocking_detector.stop()
+            hub_blocking_detector.reset()
+
+    def test_shared_pool_should_offload_to_parent_blocking_tier(self):
+        pool = ThreadPool(total_thread_number=3)
+        shared_pool = pool.new_shared_pool()
+        self.assertIsNotNone(pool.blocking_tier)
+        self.assertIs(pool.blocking_tier, shared_pool.blocking_tier)
+        shared_pool.apply_async(time.sleep, args=(0.01,), blocking=True)
+        self.assertEqual([None], shared_pool.get_results_order_by_index())
+        self.assertIs(pool.blocking_tier, shared_pool.blocking_tier)
+
+    def test_thread_pool_should_converge_concurrency_when_adaptive(self):
+        pool = ThreadPool(total_thread_number=40, adaptive=True)
+        shared_pool = pool.new_shared_pool()
+        active = [0]
+
+        def downstream():
+            active[0] += 1
+            sleep(0.005 * max(1.0, active[0] / 6))
+            active[0] -= 1
+
+        for index in range(800):
+            (pool if index % 2 else shared_pool).apply_async(downstream)
+        pool.get_results_order_by_index()
+        shared_pool.get_results_order_by_index()
+        stats = pool.concurrency_stats()
+        self.assertGreater(stats['increases'], 0)
+        self.assertGreater(stats['decreases'], 0)
+        self.assertTrue(3 <= stats['limit'] <= 18, stats)
+        self.assertIs(pool.concurrency_controller, shared_pool.concurrency_controller)
+
+    def test_thread_pool_should_report_elapsed_latency_when_deadline_expires(self):
+        pool = ThreadPool(total_thread_number=2, adaptive=True)
+        with mock.patch.object(type(pool.concurrency_controller), 'observe', autospec=True) as observe:
+            pool.set_deadline(0.2)
+            pool.apply_async(self.gevent_func_with_sleep, args=(1,), kwargs=dict(sleep_second=5))
+            res = pool.get_results_order_by_index(with_status=True)
+        self.assertIsInstance(res[0][1], TaskTimeoutError)
+        _, latency, success = observe.call_args.args
+        self.assertFalse(success)
+        self.assertGreaterEqual(latency, 0.15)
+
+    def test_thread_pool_should_coalesce_in_flight_calls_when_dedup_enabled(self):
+        pool = ThreadPool(total_thread_number=2, dedup_key=lambda url, **kwargs: url, log_exception=False)
+        calls = []
+
+        def fetch(url, fail=False):
+            calls.append(url)
+            sleep(0.1)
+            if fail:
+                raise RuntimeError(f'Not Fetched: {url}')
+            return url.upper()
+
+        for url in ['a', 'b', 'a', 'a', 'b']:
+            pool.apply_async(fetch, args=(url,))
+        pool.apply_async(fetch, args=('c',), kwargs=dict(fail=True))
+        pool.apply_async(fetch, args=('c',))
+        res = pool.get_results_order_by_index()
+        self.assertEqual(['A', 'B', 'A', 'A', 'B'], res[:5])
+        self.assertEqual(['Not Fetched: c'] * 2, [str(error) for error in res[5:]])
+        self.assertEqual(['a', 'b', 'c'], sorted(calls))
+        self.assertEqual({'executed': 3, 'coalesced': 4, 'in_flight': 0, 'followers': 0}, pool.dedup_stats())
+        pool.apply_async(fetch, args=('a',))
+        self.assertEqual(['A'], pool.get_results_order_by_index())
+        self.assertEqual(4, len(calls))
+
+    def test_native_thread_pool_should_not_spawn_threads_for_followers(self):
+        pool = NativeThreadPool(total_thread_number=2, dedup_key=lambda key: key)
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def fetch(key):
+            release.wait()
+            return key
+
+        active = threading.active_count()
+        for _ in range(50):
+            pool.apply_async(fetch, args=('a',))
+        pool.apply_async(fetch, args=('a',), timeout=0.05)
+        self.assertLessEqual(threading.active_count(), active + 2)
+        time.sleep(0.2)
+        release.set()
+        res = pool.get_results_order_by_index(with_status=True)
+        self.assertEqual([(True, 'a')] * 50, res[:50])
+        self.assertFalse(res[50][0])
+        self.assertIsInstance(res[50][1], TaskTimeoutError)
+        self.assertEqual({'executed': 1, 'coalesced': 50, 'in_flight': 0, 'followers': 0}, pool.dedup_stats())
+
+    def test_thread_pool_should_stream_through_pipeline_stages(self):
+        fetch_pool = ThreadPool(total_thread_number=8)
+        parse_pool = NativeThreadPool(total_thread_number=2)
+
+        def fetch(item):
+            sleep(0.01)
+            return item
+
+        def parse(batch):
+            time.sleep(0.01)
+            return sum(batch)
+
+        pipeline = Pipeline(range(100)).stage(fetch, fetch_pool, queue_size=4).stage(parse, parse_pool, batch_size=10)
+        self.assertEqual([sum(range(start, start + 10)) for start in range(0, 100, 10)], list(pipeline))
+        fetch_stats, parse_stats = pipeline.stats()
+        self.assertEqual(('fetch', 100, 0), (fetch_stats['name'], fetch_stats['processed'], fetch_stats['failed']))
+        self.assertEqual(('parse', 10, 0), (parse_stats['name'], parse_stats['processed'], parse_stats['failed']))
+        self.assertGreater(parse_stats['throughput'], 0)
+
+        def broken_parse(batch):
+            if 50 in batch:
+                raise RuntimeError('Not Parsed')
+            return sum(batch)
+
+        fetched = []
+        pipeline = Pipeline(range(1000)).stage(lambda item: fetched.append(item) or item, fetch_pool, queue_size=4)
+        pipeline.stage(broken_parse, parse_pool, batch_size=10)
+        with self.assertRaisesRegex(RuntimeError, '^Not Parsed$'):
+            for _ in pipeline:
+                pass
+        sleep(0.2)
+        self.assertLess(len(fetched), 200)
+
+    def test_pipeline_should_keep_hub_responsive_when_gevent_stage_follows_native_stage(self):
+        gaps = []
+        running = [True]
+
+        def tick():
+            last = time.perf_counter()
+            while running[0]:
+                sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        def slow_parse(item):
+            time.sleep(0.05)
+            return item
+
+        ticker = gevent.spawn(tick)
+        pipeline = Pipeline(range(10)).stage(slow_parse, NativeThreadPool(total_thread_number=1))
+        pipeline.stage(lambda item: item * 2, ThreadPool(total_thread_number=2))
+        self.assertEqual([item * 2 for item in range(10)], list(pipeline))
+        running[0] = False
+        ticker.join()
+        self.assertLess(max(gaps), 0.04)
+
+    def test_logger_should_stream_table_lines_with_multi_line_header(self):
+        rows = [['id', 'name\nfull']] + [[index, 'x' * index] for index in range(1, 7)]
+        self.assertEqual(['+------------------------+--------+',
+                          '|           id           |  name  |',
+                          '|                        |  full  |',
+                          '+------------------------+--------+',
+                          '|           1            |   x    |',
+                          '+------------------------+--------+',
+                          '| ... 3 rows omitted ... |  ...   |',
+                          '+------------------------+--------+',
+                          '|           5            | xxxxx  |',
+                          '+------------------------+--------+',
+                          '|           6            | xxxxxx |',
+                          '+------------------------+--------+'], list(iter_table_lines(rows, head=1, tail=2)))
+        lines = list(iter_table_lines(rows, max_cell_width=4))
+        self.assertEqual(['+----+------+', '| id | name |', '|    | full |', '+----+------+'], lines[:4])
+        self.assertEqual(['| 4  | xxxx |', '+----+------+', '| 5  | x... |'], lines[10:13])
+        self.assertEqual(lines, list(iter_table_lines(rows, sample_size=2, max_cell_width=4)))
+        self.assertEqual(['| 6  | x... |', '+----+------+'], list(iter_table_lines(rows, sample_size=2))[-2:])
+        self.assertEqual('\n'.join(lines[:8]), Logger.rows_to_table_string(rows[:3], max_cell_width=4))
+
+        stream = io.StringIO()
+        Logger.write_table(rows[:3], stream=stream)
+        self.assertEqual(Logger.rows_to_table_string(rows[:3]) + '\n', stream.getvalue())
+        with self.assertLogs('table_test', level='INFO') as records:
+            Logger.write_table(rows, logger=logging.getLogger('table_test'), lines_per_record=10)
+        self.assertEqual([10, 6], [record.getMessage().count('\n') for record in records.records])
+        with self.assertRaisesRegex(ValueError, 'incorrect number of values'):
+            list(iter_table_lines([['a', 'b'], [1]]))
+
+    def test_date_range_should_step_by_days_and_months(self):
+        date = datetime.date
+        self.assertEqual([date(2024, 1, 1), date(2024, 1, 2)], list(DateRange(date(2024, 1, 1), date(2024, 1, 3))))
+        self.assertEqual(3, len(DateRange(date(2024, 1, 1), date(2024, 1, 3), including_end=True)))
+        self.assertEqual([date(2024, 1, 1), date(2024, 1, 3)], list(DateRange(date(2024, 1, 1), date(2024, 1, 5), step=datetime.timedelta(days=2))))
+        months = DateRange(date(2024, 1, 31), date(2024, 4, 30), including_end=True, months=1)
+        self.assertEqual([date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)], list(months))
+        self.assertEqual((date(2024, 4, 30), date(2024, 2, 29)), (months[-1], months[1]))
+        self.assertIn(date(2024, 3, 31), months)
+        self.assertNotIn(date(2024, 3, 30), months)
+        self.assertEqual([date(2023, 1, 31)], list(DateRange(date(2023, 1, 31), date(2023, 2, 28), months=1)))
+        self.assertEqual([date(2024, 1, 31), date(2024, 3, 31)], list(DateRange(date(2024, 1, 31), date(2024, 4, 30), months=1, exclude={date(2024, 2, 29)})))
+        for including_end in (False, True):
+            for step in ({}, {'months': 1}):
+                self.assertEqual([], list(DateRange(date(2024, 1, 15), date(2024, 1, 10), including_end, **step)))
+                self.assertEqual([], list(DateRange(date(2024, 5, 15), date(2024, 1, 10), including_end, **step)))
+        self.assertEqual([date(2024, 1, 15)], list(DateRange(date(2024, 1, 15), date(2024, 1, 15), True, months=1)))
+        self.assertEqual([], list(DateRange(date(2024, 1, 15), date(2024, 1, 15), months=1)))
+
+    def test_in_clauses_should_chunk_escape_and_keep_order(self):
+        self.assertEqual(["('b','a')", "('c','d')"], list(iter_in_clauses(['b', 'a', 'b', 'c', 'd'], chunk_size=2)))
+        self.assertEqual(["('b','a')", "('c','d')", "('e')"], list(iter_in_clauses('bacde', chunk_size=2)))
+        self.assertEqual(["('b','a','b')"], list(iter_in_clauses(['b', 'a', 'b'], dedupe=False)))
+        self.assertIn(next(iter_in_clauses(['b', 'a', 'b'], keep_order=False)), ("('a','b')", "('b','a')"))
+        self.assertEqual(["('aa','bb')", "('cc','dd')"], list(iter_in_clauses(['aa', 'bb', 'cc', 'dd'], max_bytes=11)))
+        self.assertEqual(["('aa')", "('bb')"], list(iter_in_clauses(['aa', 'bb'], max_bytes=10)))
+        self.assertEqual(["('aa')", "('bb')"], list(iter_in_clauses(['aa', 'bb'], chunk_size=1, max_bytes=100)))
+        self.assertEqual(["('é')", "('é')"], list(iter_in_clauses(['é', 'é'], dedupe=False, max_bytes=9)))
+        self.assertEqual(["('o''k','a\\b')"], list(iter_in_clauses(["o'k", 'a\\b'])))
+        self.assertEqual(["('o''k','a\\\\b')"], list(iter_in_clauses(["o'k", 'a\\b'], backslash_escapes=True)))
+        self.assertEqual(["('o''k')"], list(iter_in_clauses(["o'k"], max_bytes=100)))
+        self.assertEqual([], list(iter_in_clauses([])))
+        self.assertEqual([], list(iter_in_clauses([], max_bytes=100)))
+        self.assertEqual("('b','a''','c')", list_to_string(['b', "a'", 'b', 'c']))
+        self.assertEqual("('1')", set_to_string({1}))
+        self.assertEqual(("('')", "('')"), (list_to_string([]), set_to_string(set())))
+
+    def test_local_variable_cache_should_evict_least_recently_used_and_invalidate_on_rewrite(self):
+        cache = LocalVariableCache(max_entries=2, max_bytes=100)
+        stat = os.stat_result((0, 0, 0, 0, 0, 0, 40, 0, 0, 0))
+        cache.put('a', stat, 'A')
+        cache.put('b', stat, 'B')
+        self.assertEqual('A', cache.get('a', stat))
+        cache.put('c', stat, 'C')
+        self.assertIsNone(cache.get('b', stat))
+        self.assertEqual({'hits': 1, 'misses': 1, 'entries': 2, 'bytes': 80}, cache.stats())
+        cache.put('d', stat, 'D', sidecar_bytes=20)
+        self.assertEqual((None, 'D'), (cache.get('a', stat), cache.get('d', stat)))
+        self.assertEqual(2, cache.stats()['entries'])
+        cache.put('e', stat, 'E', sidecar_bytes=61)
+        self.assertIsNone(cache.get('e', stat))
+
+        pkl_file_name = os.path.join(tempfile.mkdtemp(), 'value.pkl')
+        blob = os.urandom(2 * 1024 * 1024)
+        with mock.patch('misc.local_variable_cache', LocalVariableCache(max_bytes=3 * 1024 * 1024)) as cache:
+            dump_local_variable(pkl_file_name, {'value': 1})
+            self.assertEqual({'value': 1}, load_local_variable(pkl_file_name))
+            self.assertEqual(0, cache.stats()['entries'])
+            first = load_local_variable(pkl_file_name, use_memory_cache=True)
+            self.assertIs(first, load_local_variable(pkl_file_name, use_memory_cache=True))
+            self.assertEqual((1, 1), (cache.stats()['hits'], cache.stats()['misses']))
+            dump_local_variable(pkl_file_name, {'value': 2})
+            os.utime(pkl_file_name, ns=(0, os.stat(pkl_file_name).st_mtime_ns + 10 ** 9))
+            self.assertEqual({'value': 2}, load_local_variable(pkl_file_name, use_memory_cache=True))
+            dump_local_variable(pkl_file_name, {'value': blob})
+            self.assertEqual({'value': blob}, load_local_variable(pkl_file_name, use_memory_cache=True))
+            self.assertGreater(cache.stats()['bytes'], len(blob))
+            dump_local_variable(pkl_file_name, {'value': blob, 'other': os.urandom(len(blob))}, use_memory_cache=True)
+            self.assertEqual({'hits': 1, 'misses': 3, 'entries': 0, 'bytes': 0}, cache.stats())
+
+    def test_local_cached_should_compute_once_for_concurrent_callers(self):
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            sleep(0.1)
+            return [value]
+
+        cached = local_cached(name=os.path.join(tempfile.mkdtemp(), 'compute'))(compute)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cached(1))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        greenlets = [gevent.spawn(cached, 1) for _ in range(5)]
+        results.extend(greenlet.get() for greenlet in greenlets)
+        for thread in threads:
+            thread.join()
+        self.assertEqual([1], calls)
+        self.assertEqual([[1]] * 8, results)
+        self.assertEqual([2], cached(2))
+        self.assertEqual([1, 2], calls)
+
+    def test_local_variable_should_keep_previous_file_when_write_fails(self):
+        class Broken:
+            def __reduce__(self):
+                raise RuntimeError('Not Pickled')
+
+        root = tempfile.mkdtemp()
+        name = os.path.join(root, 'value')
+        self.assertEqual('old', get_variable_from_local(name, 'old'))
+        for zero_copy in (True, False):
+            with self.assertRaisesRegex(RuntimeError, '^Not Pickled$'):
+                get_variable_from_local(name, [b'x' * 1024 * 1024, Broken()], force_refresh=True, zero_copy=zero_copy)
+            self.assertEqual(['value.pkl'], os.listdir(root))
+            self.assertEqual('old', get_variable_from_local(name, 'new'))
+
+    def test_local_variable_should_round_trip_large_buffers_through_sidecar(self):
+        pkl_file_name = os.path.join(tempfile.mkdtemp(), 'value.pkl')
+        blob = os.urandom(2 * 1024 * 1024)
+        info_map = {'buffer': pickle.PickleBuffer(bytearray(blob)), 'bytes': blob, 'same_bytes': blob,
+                    'bytearray': bytearray(blob), 'small': b'small', 'created_date': datetime.datetime.now()}
+        sidecar_file_name = dump_local_variable(pkl_file_name, info_map, use_memory_cache=False)
+        self.assertIsNotNone(sidecar_file_name)
+        self.assertLess(os.path.getsize(pkl_file_name), 4096)
+        self.assertEqual(3 * len(blob), os.path.getsize(sidecar_file_name))
+        loaded = load_local_variable(pkl_file_name, use_memory_cache=False)
+        self.assertEqual(blob, bytes(loaded['buffer']))
+        self.assertEqual((bytes, blob), (type(loaded['bytes']), loaded['bytes']))
+        self.assertIs(loaded['bytes'], loaded['same_bytes'])
+        self.assertEqual((bytearray, blob), (type(loaded['bytearray']), loaded['bytearray']))
+        self.assertEqual((b'small', info_map['created_date']), (loaded['small'], loaded['created_date']))
+        self.assertIsNone(dump_local_variable(pkl_file_name, {'bytes': blob}, use_memory_cache=False, zero_copy=False))
+        self.assertFalse(os.path.exists(sidecar_file_name))
+        self.assertEqual({'bytes': blob}, load_local_variable(pkl_file_name, use_memory_cache=False))
+
+    def test_local_variable_store_should_evict_expired_then_least_recently_used(self):
+        root = tempfile.mkdtemp()
+        store = LocalVariableStore(root, max_bytes=50 * 1000, eviction_interval=0)
+
+        def make(index):
+            return bytes([index]) * 10 * 1000
+
+        expiring = local_cached(keep_time=1, name='expiring', store=store)(make)
+        cached = local_cached(name='cached', store=store)(make)
+        for index in range(20):
+            (expiring if index < 5 else cached)(index)
+        rows = store._connection().execute('SELECT file_name FROM entries ORDER BY created_at').fetchall()
+        self.assertEqual(20, len(rows))
+        for (file_name,) in rows:
+            digest = os.path.basename(file_name)[:-len('.pkl')]
+            self.assertEqual(os.path.join(root, digest[:2], digest[2:4], f'{digest}.pkl'), file_name)
+        sleep(1.1)
+        self.assertEqual(5, cached(5)[0])
+
+        def files():
+            return sorted(name for _, _, names in os.walk(root) for name in names if name.endswith(('.pkl', '.lock')))
+
+        with open(f'{rows[0][0][:-len(".pkl")]}.lock', 'a') as held:
+            fcntl.flock(held.fileno(), fcntl.LOCK_EX)
+            self.assertEqual(15, store.evict())
+        self.assertEqual(10, len(files()))
+        self.assertEqual(1, store.evict())
+        store.close()
+        self.assertLessEqual(store.total_bytes(), 50 * 1000)
+        kept = [rows[index][0] for index in (5, 17, 18, 19)]
+        self.assertEqual(sorted(kept), sorted(row[0] for row in store._connection().execute('SELECT file_name FROM entries')))
+        self.assertEqual(sorted(os.path.basename(f'{file_name[:-len(".pkl")]}{suffix}') for file_name in kept for suffix in ('.pkl', '.lock')), files())
+
+    def test_async_logger_should_keep_order_of_stdout_and_stderr_in_one_file(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(logging.getLogger('stdout_logger_0'), 'handlers', []), \
+                mock.patch.object(logging.getLogger('stderr_logger_0'), 'handlers', []):
+            file_name = os.path.join(tmp, 'ordered.log')
+            logger = CustomLogger(to_console=False, to_file_name=file_name, use_global_config=False, async_config={})
+            self.assertEqual(logger.stdout_logger.handlers, logger.stderr_logger.handlers)
+            with mock.patch.object(AsyncLogHandler, 'handleError') as handle_error:
+                logger.stdout_logger.info('%d', 'not a number')
+            handle_error.assert_called_once()
+            for index in range(5000):
+                logger.info(f'info {index}')
+            logger.error('error last')
+            for handler in logger.stdout_logger.handlers:
+                handler.close()
+            with open(file_name) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(5001, len(lines))
+            self.assertTrue(lines[-1].endswith('ERROR - error last'))
+
+    def test_buffered_file_handler_should_flush_when_idle_and_rotate_by_bytes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_name = os.path.join(tmp, 'buffered.log')
+            handler = BufferedRotatingFileHandler(file_name, flush_interval=0.2, compress=False)
+            logger = logging.Logger('buffered')
+            logger.addHandler(handler)
+            logger.info('first')
+            logger.info('tail')
+            sleep(0.6)
+            with open(file_name) as f:
+                self.assertEqual('first\ntail\n', f.read())
+            handler.close()
+
+            file_name = os.path.join(tmp, 'rotated.log')
+            handler = BufferedRotatingFileHandler(file_name, buffer_size=1, max_bytes=500, compress=False)
+            logger = logging.Logger('rotated')
+            logger.addHandler(handler)
+            for _ in range(12):
+                logger.info('\u00e9' * 50)
+            handler.close()
+            sizes = sorted(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp) if name.startswith('rotated.log'))
+            self.assertEqual([404, 404, 404], sizes)
+
     def test_thread_pool_should_reuse_pool_after_stop_threads(self):
         pool = ThreadPool(total_thread_number=2)
 